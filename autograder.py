@@ -1,10 +1,47 @@
+import random
+import itertools
+import io
+import asyncio
+import os
+import shutil
+import tempfile
+import json
 from kenken_csp import *
 from propagators import *
 from heuristics import *
+from table_store import TableStore
+from search_events import JSONLinesSink, BinaryEventSink, read_binary_events, EVENT_KINDS
+from propagation_engine import PropagationEngine
+from kenken_generator import random_latin_square, generate_board
+from kenken_cache import SolutionCache, UNSOLVABLE, canonical_board
+from mdd import MDDConstraint, mdd_from_tuples
+from local_search import MinConflicts, nQueens_model
+from kenken_io import read_boards, write_boards
+from search_strategies import lds, dds, iterative_broadening
+from decomposition import component_search, count_solutions
+from search_replay import SearchRecorder, load_recording, replay
 
 test_props = True;
 test_ord_mrv = True;
 test_ord_lcv = True;
+test_sac = True;
+test_table_store = True;
+test_cages = True;
+test_not_equal = True;
+test_async = True;
+test_generator = True;
+test_resolve = True;
+test_cache = True;
+test_events = True;
+test_mdd = True;
+test_local_search = True;
+test_board_io = True;
+test_strategies = True;
+test_components = True;
+test_replay = True;
+test_ac4 = True;
+test_engine_bounds = True;
+test_adaptive = True;
 
 boards = [ [[3],[11,21,3,0],[12,22,2,1],[13,23,33,6,3],[31,32,5,0]],
 [[4],[11,21,6,3],[12,13,3,0],[14,24,3,1],[22,23,7,0],[31,32,2,2],[33,43,3,1],[34,44,6,3],[41,42,7,0]],
@@ -117,3 +154,467 @@ if __name__ == "__main__":
                 print("Failed Second LCV test")
         else:
             print("No Values Returned from val_lcv")
+
+    if test_sac:
+
+        #SAC prunes X=1 (X=1 forces Y=2 and Z=1, which YZ forbids); the GAC
+        #cascade of that prune then removes X=2, a later value of the same
+        #variable, which SAC must not try to assign
+        x = Variable('X', [1,2,3])
+        y = Variable('Y', [1,2])
+        z = Variable('Z', [1,2])
+
+        sac_CSP = CSP("SAC", [x,y,z])
+        cxy = Constraint("X_Y",[x,y])
+        cxy.add_satisfying_tuples([(1,2),(2,1),(3,2)])
+        sac_CSP.add_constraint(cxy)
+        cyz = Constraint("Y_Z",[y,z])
+        cyz.add_satisfying_tuples([(1,1),(2,2)])
+        sac_CSP.add_constraint(cyz)
+        cxz = Constraint("X_Z",[x,z])
+        cxz.add_satisfying_tuples([(1,1),(2,2),(3,2)])
+        sac_CSP.add_constraint(cxz)
+
+        status, pruned = prop_SAC(sac_CSP)
+        if (status and len(pruned) == len(set(pruned)) and x.cur_domain() == [3]
+                and y.cur_domain() == [2] and z.cur_domain() == [2]
+                and not any(var.is_assigned() for var in sac_CSP.vars)):
+            print("Passed SAC Cascade Test")
+        else:
+            print("Failed SAC Cascade Test")
+
+    if test_table_store:
+
+        #CSP.reduce commits the root prunings, which re-indexes the domains;
+        #the shared tables must still read their value indices against the
+        #domains they were stored with
+        csp, var_array = kenken_csp_model(boards[1])
+        solver = BT(csp)
+        solver.bt_search(prop_GAC)
+        expected = [[var.get_assigned_value() for var in row] for row in var_array]
+
+        csp, var_array = kenken_csp_model(boards[1])
+        store = TableStore()
+        store.share(csp)
+        solver = BT(csp)
+        status = solver.bt_search(prop_GAC, reduce_root=True)
+        if status and [[var.get_assigned_value() for var in row] for row in var_array] == expected:
+            print("Passed Shared Table Reduce Test")
+        else:
+            print("Failed Shared Table Reduce Test")
+        store.close()
+
+    if test_cages:
+
+        #a native cage accepts exactly the tuples of its table, also for
+        #minus and divide, whose table used to accept wrong tuples with the
+        #expected output as first value (e.g. (1,3) for 1-)
+        mismatches = 0
+        for cells in ([(0,0),(0,1)], [(0,0),(1,0),(1,1)], [(0,0),(1,1)]):
+            for operation in (0, 1, 2, 3):
+                for expected_output in range(1, 13):
+                    table = set(cage_tuples(4, cells, operation, expected_output))
+                    cells_vars = [Variable('C{}'.format(i), [1,2,3,4]) for i in range(len(cells))]
+                    cage = CageConstraint("cage", cells_vars, operation, expected_output, cage_line_pairs(cells))
+                    for vals in itertools.product([1,2,3,4], repeat=len(cells)):
+                        if cage.check(vals) != (vals in table):
+                            mismatches += 1
+        if mismatches == 0:
+            print("Passed Cage Table Test")
+        else:
+            print("Failed Cage Table Test")
+
+    if test_not_equal:
+
+        #NotEqualConstraint prunes as the table of its not-equal pairs does
+        same = True
+        for prop in (prop_FC, prop_GAC):
+            results = []
+            for native in (True, False):
+                x = Variable('X', [1,2,3])
+                y = Variable('Y', [2])
+                z = Variable('Z', [2,3])
+                ne_CSP = CSP("NotEqual", [x,y,z])
+                for var1, var2 in ((x,y), (y,z), (x,z)):
+                    if native:
+                        c = NotEqualConstraint("{}_{}".format(var1.name, var2.name), [var1, var2])
+                    else:
+                        c = Constraint("{}_{}".format(var1.name, var2.name), [var1, var2])
+                        c.add_satisfying_tuples([(v1, v2) for v1 in var1.domain() for v2 in var2.domain() if v1 != v2])
+                    ne_CSP.add_constraint(c)
+                y.assign(2)
+                status, pruned = prop(ne_CSP, y)
+                results.append((status, x.cur_domain(), z.cur_domain()))
+            same = same and results[0] == results[1]
+
+        #and the binary grid built from it solves to a Latin square
+        csp, var_array = binary_ne_grid([[5]])
+        solver = BT(csp)
+        solver.bt_search(prop_GAC, ord_mrv)
+        rows = [[var.get_assigned_value() for var in row] for row in var_array]
+        latin = all(sorted(row) == [1,2,3,4,5] for row in rows + [list(col) for col in zip(*rows)])
+        if same and latin:
+            print("Passed Not Equal Test")
+        else:
+            print("Failed Not Equal Test")
+
+    if test_async:
+
+        #cancel an async solve mid-search: the CSP must be left clean (no
+        #assignment, no listener, 'end' logged) for a second search
+        csp, var_array = kenken_csp_model(boards[3])
+        solver = BT(csp)
+        log = io.StringIO()
+        solver.log_events(JSONLinesSink(log))
+        engine = PropagationEngine()
+
+        async def cancel_solve():
+            task = asyncio.ensure_future(solver.bt_search_async(engine, ord_mrv, yield_every=1))
+            for _ in range(5):
+                await asyncio.sleep(0)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                return True
+            return False
+
+        cancelled = asyncio.run(cancel_solve())
+        clean = (not any(var.is_assigned() or var.listener is not None for var in csp.vars)
+                 and log.getvalue().splitlines()[-1] == '{"e":"e","l":0}')
+        solver.log_events(None)
+        solved = solver.bt_search(engine, ord_mrv)
+        valid = all(c.check([var.get_assigned_value() for var in c.get_scope()]) for c in csp.get_all_cons())
+        if cancelled and clean and solved and valid:
+            print("Passed Async Cancel Test")
+        else:
+            print("Failed Async Cancel Test")
+
+    if test_generator:
+
+        #random_latin_square draws Latin squares, all 12 of size 3 about
+        #equally often, and a generated board is solved by its solution
+        rng = random.Random(33)
+        counts = dict()
+        latin = True
+        for _ in range(600):
+            square = random_latin_square(3, rng)
+            latin = latin and all(sorted(line) == [1,2,3] for line in square + [list(col) for col in zip(*square)])
+            key = tuple(map(tuple, square))
+            counts[key] = counts.get(key, 0) + 1
+        uniform = len(counts) == 12 and min(counts.values()) >= 25 and max(counts.values()) <= 80
+
+        kenken_grid, solution = generate_board(5, random.Random(5), unique=True)
+        csp, var_array = kenken_csp_model(kenken_grid)
+        for row, vals in zip(var_array, solution):
+            for var, val in zip(row, vals):
+                var.assign(val)
+        consistent = all(c.check([var.get_assigned_value() for var in c.get_scope()]) for c in csp.get_all_cons())
+        if latin and uniform and consistent:
+            print("Passed Board Generator Test")
+        else:
+            print("Failed Board Generator Test")
+
+    if test_resolve:
+
+        #after adding a constraint the previous solution guides every
+        #decision and the previous root prunings are seeded; after removing
+        #one nothing is seeded
+        csp, var_array = kenken_csp_model(boards[2])
+        solver = BT(csp)
+        solver.bt_search(prop_GAC, ord_mrv)
+        solution = [[var.get_assigned_value() for var in row] for row in var_array]
+        old_root_prunings = list(solver.root_prunings)
+
+        corner = Constraint("corner", [var_array[0][0]])
+        corner.add_satisfying_tuples([(solution[0][0],)])
+        csp.add_constraint(corner)
+        solved = solver.bt_resolve(prop_GAC, ord_mrv)
+        hinted = (solved and solver.nDecisions == len(csp.vars)
+                  and solution == [[var.get_assigned_value() for var in row] for row in var_array])
+        corner_root_prunings = list(solver.root_prunings)
+        seeded = (corner_root_prunings[:len(old_root_prunings)] == old_root_prunings
+                  and len(corner_root_prunings) > len(old_root_prunings))
+
+        csp.remove_constraint(corner)
+        solved = solver.bt_resolve(prop_GAC, ord_mrv)
+        relaxed = (solved and solver.root_prunings == old_root_prunings
+                   and solution == [[var.get_assigned_value() for var in row] for row in var_array])
+        if hinted and seeded and relaxed:
+            print("Passed Resolve Test")
+        else:
+            print("Failed Resolve Test")
+
+    if test_cache:
+
+        #a board with its cages reordered is a hit, an entry evicted from
+        #the LRU is read back from disk, and an unsolvable board is
+        #searched only once
+        db_dir = tempfile.mkdtemp()
+        cache = SolutionCache(os.path.join(db_dir, "solutions.db"), capacity=1)
+        solution = cache.solve(boards[1])
+        reordered = [boards[1][0]] + list(reversed(boards[1][1:]))
+        hit = cache.solve(reordered) == solution and cache.nHits == 1
+        unsolvable = [[3],[11,21,3,0],[12,22,2,1],[13,23,33,7,3],[31,32,5,0]]
+        first = cache.solve(unsolvable)
+        negative = first is None and cache.solve(unsolvable) is None and cache.nHits == 2
+        cache.close()
+
+        cache = SolutionCache(os.path.join(db_dir, "solutions.db"), capacity=1)
+        persisted = (cache.get(boards[1]) == solution and cache.get(unsolvable) == UNSOLVABLE
+                     and cache.nHits == 2)
+        cache.close()
+        shutil.rmtree(db_dir)
+        if solution and hit and negative and persisted:
+            print("Passed Solution Cache Test")
+        else:
+            print("Failed Solution Cache Test")
+
+    if test_events:
+
+        #the JSON lines and binary sinks log the same events, and the
+        #binary log reads back to the decisions the search made
+        logs = []
+        for binary in (False, True):
+            csp, var_array = kenken_csp_model(boards[1])
+            solver = BT(csp)
+            out = io.BytesIO() if binary else io.StringIO()
+            solver.log_events(BinaryEventSink(out, csp) if binary else JSONLinesSink(out))
+            solver.bt_search(prop_FC, ord_mrv)
+            solver.events.close()
+            logs.append(out.getvalue())
+        json_events = [json.loads(line) for line in logs[0].splitlines()]
+        log_dir = tempfile.mkdtemp()
+        with open(os.path.join(log_dir, "events.bin"), 'wb') as f:
+            f.write(logs[1])
+        binary_events = read_binary_events(os.path.join(log_dir, "events.bin"))
+        shutil.rmtree(log_dir)
+        decisions = [(e['var'], e['val']) for e in json_events if e['e'] == 'd']
+        same = (len(json_events) == len(binary_events)
+                and [e['kind'] for e in binary_events] == [EVENT_KINDS[e['e']] for e in json_events]
+                and decisions == [(e['var'], e['val']) for e in binary_events if e['kind'] == 'decision']
+                and len(decisions) == solver.nDecisions)
+        if same and binary_events[-1]['kind'] == 'end' and binary_events[-1]['status']:
+            print("Passed Event Log Test")
+        else:
+            print("Failed Event Log Test")
+
+    if test_mdd:
+
+        #the supported values of MDD (all-different and cage tables) and
+        #AllDiff constraints match a brute force enumeration, on random
+        #current domains
+        rng = random.Random(39)
+        cage_table = cage_tuples(5, [(0,0),(0,1),(1,0),(1,1)], 0, 12)
+        mismatches = 0
+        for _ in range(50):
+            scope = [Variable('V{}'.format(i), [1,2,3,4,5]) for i in range(4)]
+            for var in scope:
+                for val in rng.sample([1,2,3,4,5], rng.randint(0, 3)):
+                    var.prune_value(val)
+            for constraint in (MDDConstraint("mdd_diff", scope, alldiff_mdd([1,2,3,4,5], 4)),
+                               MDDConstraint("mdd_cage", scope, mdd_from_tuples(4, cage_table)),
+                               AllDiffConstraint("all_diff", scope)):
+                expected = dict((var, set()) for var in scope)
+                for vals in itertools.product(*[var.cur_domain() for var in scope]):
+                    if constraint.check(vals):
+                        for var, val in zip(scope, vals):
+                            expected[var].add(val)
+                if constraint.supported_values() != expected:
+                    mismatches += 1
+        if mismatches == 0:
+            print("Passed Supported Values Test")
+        else:
+            print("Failed Supported Values Test")
+
+    if test_local_search:
+
+        #min-conflicts solves 200-queens and, keeping the rows permutations,
+        #the 5x5 board; the answers are checked directly
+        csp = nQueens_model(200)
+        solved = MinConflicts(csp).search(walk_prob=0.0, sample_size=50, seed=41)
+        queens = [var.get_assigned_value() for var in csp.get_all_vars()]
+        queens_ok = solved and all(queens[i] != queens[j] and abs(queens[i] - queens[j]) != j - i
+                                   for i in range(200) for j in range(i+1, 200))
+
+        csp, var_array = kenken_csp_model(boards[2], native_cages=True)
+        solved = MinConflicts(csp).search(walk_prob=0.01, tabu_tenure=2, weighted=True, swap_groups=var_array, seed=41)
+        kenken_ok = solved and all(c.check([var.get_assigned_value() for var in c.get_scope()])
+                                   for c in csp.get_all_cons())
+        if queens_ok and kenken_ok:
+            print("Passed Local Search Test")
+        else:
+            print("Failed Local Search Test")
+
+    if test_board_io:
+
+        #boards written and read back are the same boards, including one
+        #larger than 9x9; a malformed board is reported and skipped
+        big_grid, _ = generate_board(12, random.Random(42))
+        text = io.StringIO()
+        write_boards(text, boards + [big_grid])
+        text = io.StringIO(text.getvalue() + "\n3\n1,1 2,1 3 +\n1,2 x 2 -\n")
+        read_back = list(read_boards(text))
+        if (len(read_back) == len(boards) + 1
+                and [canonical_board(b) for b in read_back] == [canonical_board(b) for b in boards + [big_grid]]):
+            print("Passed Board File Test")
+        else:
+            print("Failed Board File Test")
+
+    if test_strategies:
+
+        #lds, dds and iterative broadening find the solutions depth-first
+        #search finds, and, being complete, prove an unsolvable board has none
+        unsolvable = [[3],[11,21,3,0],[12,22,2,1],[13,23,33,7,3],[31,32,5,0]]
+        agree = True
+        for b in boards[:3] + [unsolvable]:
+            csp, var_array = kenken_csp_model(b)
+            solver = BT(csp)
+            expected = solver.bt_search(prop_FC, ord_mrv)
+            expected_values = [[var.get_assigned_value() for var in row] for row in var_array]
+            for strategy in (lds, dds, iterative_broadening):
+                solver.set_strategy(strategy)
+                status = solver.bt_search(prop_FC, ord_mrv, val_lcv)
+                agree = (agree and status == expected
+                         and [[var.get_assigned_value() for var in row] for row in var_array] == expected_values)
+                solver.restore_all_variable_domains()
+        if agree:
+            print("Passed Search Strategy Test")
+        else:
+            print("Failed Search Strategy Test")
+
+    if test_components:
+
+        #count_solutions, with and without decomposition, matches a brute
+        #force count on the 3x3 board and on a CSP of three components;
+        #component_search solves the latter with a valid assignment
+        x = [Variable('X{}'.format(i), [1,2,3]) for i in range(3)]
+        y = [Variable('Y{}'.format(i), [1,2,3]) for i in range(2)]
+        z = Variable('Z', [1,2])
+        parts_CSP = CSP("Parts", x + y + [z])
+        for var1, var2 in itertools.combinations(x, 2):
+            parts_CSP.add_constraint(NotEqualConstraint("{}_{}".format(var1.name, var2.name), [var1, var2]))
+        parts_CSP.add_constraint(NotEqualConstraint("Y0_Y1", y))
+        csp, var_array = kenken_csp_model(boards[0])
+
+        counts_ok = True
+        for count_CSP in (csp, parts_CSP):
+            expected = 0
+            for vals in itertools.product(*[var.domain() for var in count_CSP.get_all_vars()]):
+                value_of = dict(zip(count_CSP.get_all_vars(), vals))
+                if all(c.check([value_of[var] for var in c.get_scope()]) for c in count_CSP.get_all_cons()):
+                    expected += 1
+            for decompose in (True, False):
+                counts_ok = counts_ok and count_solutions(count_CSP, prop_FC, ord_mrv, decompose=decompose) == expected
+
+        solver = BT(parts_CSP)
+        solver.set_strategy(component_search)
+        solved = solver.bt_search(prop_GAC, ord_mrv)
+        valid = all(c.check([var.get_assigned_value() for var in c.get_scope()]) for c in parts_CSP.get_all_cons())
+        if counts_ok and solved and valid:
+            print("Passed Components Test")
+        else:
+            print("Failed Components Test")
+
+    if test_replay:
+
+        #a saved search path replays the same decisions with the same
+        #outcomes; replayed with GAC instead of FC it diverges
+        csp, var_array = kenken_csp_model(boards[2])
+        solver = BT(csp)
+        recorder = SearchRecorder(csp.name)
+        solver.log_events(recorder)
+        solver.bt_search(prop_FC, ord_mrv, val_lcv)
+        saved = io.StringIO()
+        recorder.save(saved)
+        recording = load_recording(io.StringIO(saved.getvalue()))
+
+        csp, var_array = kenken_csp_model(boards[2])
+        report = replay(csp, prop_FC, recording)
+        same = (report.root == recording.root and not report.divergences and report.skipped == 0
+                and [node[2:6] for node in report.nodes] == [node[1:5] for node in recording.nodes]
+                and len(recording.nodes) == solver.nDecisions)
+        csp, var_array = kenken_csp_model(boards[2])
+        report = replay(csp, prop_GAC, recording)
+        differs = len(report.divergences) > 0
+        if same and differs:
+            print("Passed Search Replay Test")
+        else:
+            print("Failed Search Replay Test")
+
+    if test_ac4:
+
+        #AC4Propagator reaches the GAC fixpoint, so it makes the decisions
+        #prop_GAC makes, on the table cages of the KenKen model and on the
+        #binary grid, whose not-equal constraints it counts without tuples
+        agree = True
+        for b in boards:
+            for model in (kenken_csp_model, binary_ne_grid):
+                results = []
+                for propagator in (prop_GAC, AC4Propagator()):
+                    csp, var_array = model(b)
+                    solver = BT(csp)
+                    status = solver.bt_search(propagator, ord_mrv)
+                    results.append((status, solver.nDecisions,
+                                    [[var.get_assigned_value() for var in row] for row in var_array]))
+                agree = agree and results[0] == results[1]
+                if model is binary_ne_grid:
+                    agree = agree and not propagator.fallback and not propagator.supports
+        if agree:
+            print("Passed AC4 Test")
+        else:
+            print("Failed AC4 Test")
+
+    if test_engine_bounds:
+
+        #plus and minus cages wake on 'bounds' only: removing an inner value
+        #of a cell does not queue its plus cage, removing the largest does
+        csp, var_array = kenken_csp_model([[3], [11, 12, 13, 6, 0], [21, 22, 23, 6, 3]], native_cages=True)
+        plus, times = [c for c in csp.get_all_cons() if isinstance(c, CageConstraint)]
+        engine = PropagationEngine()
+        engine.attach(csp)
+        engine.active = True
+        var_array[0][0].prune_value(2)
+        inner = not plus in engine.queued
+        var_array[0][1].prune_value(3)
+        outer = plus in engine.queued
+        engine.active = False
+        engine.detach()
+        correct = plus.wake_on == 'bounds' and times.wake_on == 'remove' and inner and outer
+
+        #and the engine still solves every board
+        for b in boards:
+            csp, var_array = kenken_csp_model(b, native_cages=True)
+            solver = BT(csp)
+            correct = correct and solver.bt_search(PropagationEngine(), ord_mrv)
+            for c in csp.get_all_cons():
+                correct = correct and c.check([var.get_assigned_value() for var in c.get_scope()])
+        if correct:
+            print("Passed Bounds Event Test")
+        else:
+            print("Failed Bounds Event Test")
+
+    if test_adaptive:
+
+        #with min_rate 0 every group stays productive, so the adaptive
+        #propagator makes the decisions prop_GAC makes; with the default
+        #rate it must still find valid solutions
+        correct = True
+        for b in boards:
+            results = []
+            for propagator in (prop_GAC, AdaptivePropagator(min_rate=0)):
+                csp, var_array = kenken_csp_model(b)
+                solver = BT(csp)
+                status = solver.bt_search(propagator, ord_mrv)
+                results.append((status, solver.nDecisions))
+            correct = correct and results[0] == results[1]
+
+            csp, var_array = kenken_csp_model(b)
+            solver = BT(csp)
+            correct = correct and solver.bt_search(AdaptivePropagator(), ord_mrv)
+            for c in csp.get_all_cons():
+                correct = correct and c.check([var.get_assigned_value() for var in c.get_scope()])
+        if correct:
+            print("Passed Adaptive Propagator Test")
+        else:
+            print("Failed Adaptive Propagator Test")
@@ -1,5 +1,8 @@
 import time
 import functools
+import asyncio
+
+from search_events import PrintEventSink
 
 '''Constraint Satisfaction Routines
    A) class Variable
@@ -41,7 +44,8 @@ class Variable:
     '''Class for defining CSP variables.  On initialization the
        variable object should be given a name, and optionally a list of
        domain values. Later on more domain values an be added...but
-       domain values can never be removed.
+       domain values can never be removed, except by commit_cur_domain
+       (see CSP.reduce), which can be undone with reset_domain.
 
        The variable object offers two types of functionality to support
        search. 
@@ -72,6 +76,9 @@ class Variable:
            flags are not changed so that pruning and unpruning can
            work independently of assignment and unassignment. 
            '''
+    __slots__ = ('name', 'dom', 'dom_index', 'curdom', 'curdom_count',
+                 'assignedValue', 'listener')
+
     #
     #set up and info methods
     #
@@ -80,17 +87,25 @@ class Variable:
         string). Optionally specify the initial domain.
         '''
         self.name = name                #text name for variable
-        self.dom = list(domain)         #Make a copy of passed domain
-        self.curdom = [True] * len(domain)      #using list
+        self.dom = []
+        self.dom_index = dict()         #value --> index in dom
+        self.curdom = []                #using list
+        self.curdom_count = 0           #number of True flags in curdom
+        self.add_domain_values(domain)
         #for bt_search
         self.assignedValue = None
+        #told of prunings and assignments, see propagation_engine.py
+        self.listener = None
 
     def add_domain_values(self, values):
         '''Add additional domain values to the domain
            Removals not supported removals'''
         for val in values: 
+            if not val in self.dom_index:
+                self.dom_index[val] = len(self.dom)
             self.dom.append(val)
             self.curdom.append(True)
+            self.curdom_count += 1
 
     def domain_size(self):
         '''Return the size of the (permanent) domain'''
@@ -106,11 +121,19 @@ class Variable:
 
     def prune_value(self, value):
         '''Remove value from CURRENT domain'''
-        self.curdom[self.value_index(value)] = False
+        i = self.value_index(value)
+        if self.curdom[i]:
+            self.curdom[i] = False
+            self.curdom_count -= 1
+            if self.listener is not None:
+                self.listener.on_prune(self, value)
 
     def unprune_value(self, value):
         '''Restore value to CURRENT domain'''
-        self.curdom[self.value_index(value)] = True
+        i = self.value_index(value)
+        if not self.curdom[i]:
+            self.curdom[i] = True
+            self.curdom_count += 1
 
     def cur_domain(self):
         '''return list of values in CURRENT domain (if assigned 
@@ -128,7 +151,7 @@ class Variable:
         '''check if value is in CURRENT domain (without constructing list)
            if assigned only assigned value is viewed as being in current 
            domain'''
-        if not value in self.dom:
+        if not value in self.dom_index:
             return False
         if self.is_assigned():
             return value == self.get_assigned_value()
@@ -140,12 +163,30 @@ class Variable:
         if self.is_assigned():
             return 1
         else:
-            return(sum(1 for v in self.curdom if v))
+            return self.curdom_count
 
     def restore_curdom(self):
         '''return all values back into CURRENT domain'''
         for i in range(len(self.curdom)):
             self.curdom[i] = True
+        self.curdom_count = len(self.curdom)
+
+    def commit_cur_domain(self):
+        '''Make the CURRENT domain (ignoring any assignment) the permanent
+           domain: pruned values are dropped for good. Returns the previous
+           domain, to be passed to reset_domain to undo the commit'''
+        old_dom = list(self.dom)
+        kept = [val for i, val in enumerate(self.dom) if self.curdom[i]]
+        self.reset_domain(kept)
+        return old_dom
+
+    def reset_domain(self, values):
+        '''Replace the permanent domain by values, all of them current'''
+        self.dom = []
+        self.dom_index = dict()
+        self.curdom = []
+        self.curdom_count = 0
+        self.add_domain_values(values)
 
     #
     #methods for assigning and unassigning
@@ -165,6 +206,8 @@ class Variable:
             return
 
         self.assignedValue = value
+        if self.listener is not None:
+            self.listener.on_assign(self)
 
     def unassign(self):
         '''Used by bt_search. Unassign and restore old curdom'''
@@ -184,7 +227,7 @@ class Variable:
     def value_index(self, value):
         '''Domain values need not be numbers, so return the index
            in the domain list of a variable value'''
-        return self.dom.index(value)
+        return self.dom_index[value]
 
     def __repr__(self):
         return("Var-{}".format(self.name))
@@ -197,12 +240,80 @@ class Variable:
         print("Var--\"{}\": Dom = {}, CurDom = {}".format(self.name, 
                                                              self.dom, 
                                                              self.curdom))
+class IntRangeVariable(Variable):
+    '''Variable whose domain is the integer interval lo..hi. The domain is
+       kept as a range object and the current domain flags are only
+       allocated on the first pruning, so a variable costs O(1) memory
+       until it is pruned. Meant for models with very many variables over
+       large domains (e.g. the 10^5 variables of 10^5-queens). Domain
+       values cannot be added.'''
+
+    __slots__ = ('lo',)
+
+    def __init__(self, name, lo, hi):
+        self.name = name
+        self.lo = lo
+        self.dom = range(lo, hi+1)
+        self.dom_index = None
+        self.curdom = None              #allocated on first pruning
+        self.curdom_count = len(self.dom)
+        self.assignedValue = None
+        self.listener = None
+
+    def add_domain_values(self, values):
+        print("ERROR: cannot add domain values to IntRangeVariable", self)
+
+    def value_index(self, value):
+        return value - self.lo
+
+    def prune_value(self, value):
+        if self.curdom is None:
+            self.curdom = bytearray([True]) * len(self.dom)
+        Variable.prune_value(self, value)
+
+    def unprune_value(self, value):
+        if self.curdom is not None:
+            Variable.unprune_value(self, value)
+
+    def cur_domain(self):
+        if not self.is_assigned() and self.curdom is None:
+            return list(self.dom)
+        return Variable.cur_domain(self)
+
+    def in_cur_domain(self, value):
+        if not (isinstance(value, int) and self.lo <= value < self.lo + len(self.dom)):
+            return False
+        if self.is_assigned():
+            return value == self.get_assigned_value()
+        return self.curdom is None or bool(self.curdom[value - self.lo])
+
+    def restore_curdom(self):
+        self.curdom = None
+        self.curdom_count = len(self.dom)
+
+    def commit_cur_domain(self):
+        '''The interval is kept as it is: nothing is committed'''
+        return None
+
+    def reset_domain(self, values):
+        pass
+
 class Constraint: 
     '''Class for defining constraints variable objects specifes an
        ordering over variables.  This ordering is used when calling
        the satisfied function which tests if an assignment to the
        variables in the constraint's scope satisfies the constraint'''
 
+    #True when the constraint is given by its table of satisfying tuples;
+    #subclasses that implement check and has_support directly set it to
+    #False so that propagators do not consult the (empty) table indexes
+    table_based = True
+    #the weakest change of a scope variable that can make the constraint
+    #prune: 'remove' (any value removed), 'bounds' (smallest or largest
+    #value removed) or 'fix' (variable down to one value), see
+    #propagation_engine.py
+    wake_on = 'remove'
+
     def __init__(self, name, scope): 
         '''create a constraint object, specify the constraint name (a
         string) and its scope (an ORDERED list of variable objects).
@@ -219,15 +330,24 @@ class Constraint:
         with a function.  
         '''
 
-        self.scope = list(scope)
+        self.scope = tuple(scope)   #immutable, so get_scope need not copy it
         self.name = name
         self.sat_tuples = dict()
 
         #The next object data item 'sup_tuples' will be used to help
         #support GAC propgation. It allows access to a list of 
         #satisfying tuples that contain a particular variable/value
-        #pair.
+        #pair. It is only needed by has_support, so it is built
+        #lazily the first time it is requested (see get_sup_tuples);
+        #BT and FC never pay for it.
         self.sup_tuples = dict()
+        self.sup_tuples_built = False
+
+        #'projections' helps forward checking: projections[i] maps the
+        #values of all scope variables but the i-th (a tuple, in scope
+        #order) to the set of values the i-th variable may then take.
+        #Each position's index is built lazily by get_projection.
+        self.projections = dict()
 
     def add_satisfying_tuples(self, tuples):
         '''We specify the constraint by adding its complete list of satisfying tuples.'''
@@ -235,17 +355,71 @@ class Constraint:
             t = tuple(x)  #ensure we have an immutable tuple
             if not t in self.sat_tuples:
                 self.sat_tuples[t] = True
-
-            #now put t in as a support for all of the variable values in it
-            for i, val in enumerate(t):
-                var = self.scope[i]
-                if not (var,val) in self.sup_tuples:
-                    self.sup_tuples[(var,val)] = []
-                self.sup_tuples[(var,val)].append(t)
+                #keep already built indexes up to date
+                if self.sup_tuples_built:
+                    self.add_supports(t)
+                for i, projection in self.projections.items():
+                    self.add_projection(projection, i, t)
+
+    def add_supports(self, t):
+        '''Internal routine. Put t in as a support for all of the
+           variable values in it'''
+        for i, val in enumerate(t):
+            var = self.scope[i]
+            if not (var,val) in self.sup_tuples:
+                self.sup_tuples[(var,val)] = []
+            self.sup_tuples[(var,val)].append(t)
+
+    def get_sup_tuples(self):
+        '''return the (var,val) --> [supporting tuples] index, building
+           it from sat_tuples on first use'''
+        if not self.sup_tuples_built:
+            self.sup_tuples = dict()
+            for t in self.sat_tuples:
+                self.add_supports(t)
+            self.sup_tuples_built = True
+        return self.sup_tuples
+
+    def add_projection(self, projection, i, t):
+        '''Internal routine. Put t in the projection index of position i'''
+        key = t[:i] + t[i+1:]
+        if not key in projection:
+            projection[key] = set()
+        projection[key].add(t[i])
+
+    def get_projection(self, i):
+        '''return the index mapping the values of all scope variables but
+           the i-th to the set of allowed values of the i-th, building it
+           from sat_tuples on first use'''
+        if not i in self.projections:
+            projection = dict()
+            for t in self.sat_tuples:
+                self.add_projection(projection, i, t)
+            self.projections[i] = projection
+        return self.projections[i]
+
+    def reduce_to_cur_domains(self):
+        '''Remove for good the satisfying tuples that are no longer valid
+           (some value pruned from the current domains), so that later
+           support scans skip them. The support lists are rebuilt from the
+           remaining tuples if they were built, projections are dropped and
+           rebuilt on demand. Returns the removed tuples, to be passed to
+           add_satisfying_tuples to undo the reduction'''
+        if not self.table_based:
+            return []
+        removed = [t for t in self.sat_tuples if not self.tuple_is_valid(t)]
+        if removed:
+            for t in removed:
+                del self.sat_tuples[t]
+            if self.sup_tuples_built:
+                self.sup_tuples_built = False
+                self.get_sup_tuples()
+            self.projections = dict()
+        return removed
 
     def get_scope(self):
-        '''get list of variables the constraint is over'''
-        return list(self.scope)
+        '''get the (immutable, ordered) tuple of variables the constraint is over'''
+        return self.scope
 
     def check(self, vals):
         '''Given list of values, one for each variable in the
@@ -278,8 +452,9 @@ class Constraint:
            of assignments satisfying the constraint where each value is
            still in the corresponding variables current domain
         '''
-        if (var, val) in self.sup_tuples:
-            for t in self.sup_tuples[(var, val)]:
+        sup_tuples = self.get_sup_tuples()
+        if (var, val) in sup_tuples:
+            for t in sup_tuples[(var, val)]:
                 if self.tuple_is_valid(t):
                     return True
         return False
@@ -295,6 +470,146 @@ class Constraint:
     def __str__(self):
         return("{}({})".format(self.name,[var.name for var in self.scope]))
 
+class NotEqualConstraint(Constraint):
+    '''Binary constraint requiring its two variables to take different
+       values. It is represented by the relation itself rather than by a
+       table of satisfying tuples, so building it costs O(1), and both
+       check and has_support run in O(1) (using the maintained count of
+       the other variable's current domain).'''
+
+    table_based = False
+    #a value loses its support only when the other variable is fixed to it
+    wake_on = 'fix'
+
+    def __init__(self, name, scope):
+        Constraint.__init__(self, name, scope)
+        if len(self.scope) != 2:
+            print("ERROR: NotEqualConstraint", name, "needs a scope of exactly 2 variables")
+
+    def other_var(self, var):
+        '''return the variable of the scope that is not var'''
+        return self.scope[1] if self.scope[0] is var else self.scope[0]
+
+    def check(self, vals):
+        return vals[0] != vals[1]
+
+    def has_support(self, var, val):
+        '''var=val is supported iff the other variable still has some
+           value different from val'''
+        other = self.other_var(var)
+        if other.is_assigned():
+            return other.get_assigned_value() != val
+        if other.curdom_count >= 2:
+            return True
+        if other.curdom_count == 1:
+            return other.cur_domain()[0] != val
+        return False
+
+class AllDiffConstraint(Constraint):
+    '''N-ary constraint requiring all the variables of its scope to take
+       different values, represented by the relation itself: no table of
+       the n! permutations is built, so it can be used on large boards.
+
+       supported_values computes the supported values of the whole scope
+       at once (Regin's filtering): a value is supported iff its edge lies
+       on some maximum matching of the variable/value graph, found from one
+       matching and the strongly connected components of the residual
+       graph, in O(n * d) for n variables of domain size d.'''
+
+    table_based = False
+
+    def check(self, vals):
+        return len(set(vals)) == len(vals)
+
+    def supported_values(self):
+        '''return a dict var --> set of the values of var that some
+           assignment of all different current domain values gives var'''
+        doms = [var.cur_domain() for var in self.scope]
+        supported = dict((var, set()) for var in self.scope)
+
+        #maximum matching, by augmenting paths
+        match_of_val = dict()       #value --> index of the variable matched to it
+        match_of_var = [None] * len(self.scope)
+        def augment(i, visited):
+            for val in doms[i]:
+                if not val in visited:
+                    visited.add(val)
+                    if not val in match_of_val or augment(match_of_val[val], visited):
+                        match_of_val[val] = i
+                        match_of_var[i] = val
+                        return True
+            return False
+        for i in range(len(self.scope)):
+            if not augment(i, set()):
+                return supported
+
+        #residual graph: variable --> its unmatched values, value --> its matched variable.
+        #Values reaching a free value are on an even alternating path, all their edges are supported
+        free_reaching = set(val for dom in doms for val in dom if not val in match_of_val)
+        vals_of_var = dict()
+        for i, dom in enumerate(doms):
+            for val in dom:
+                vals_of_var.setdefault(val, []).append(i)
+        stack = list(free_reaching)
+        while stack:
+            val = stack.pop()
+            for i in vals_of_var[val]:
+                matched = match_of_var[i]
+                if matched != val and not matched in free_reaching:
+                    free_reaching.add(matched)
+                    stack.append(matched)
+
+        #strongly connected components (Tarjan) of the residual graph: nodes are
+        #('x', i) for variables and ('v', val) for values
+        index = dict()
+        lowlink = dict()
+        component = dict()
+        on_stack = set()
+        tarjan_stack = []
+        counter = [0]
+        def successors(node):
+            if node[0] == 'x':
+                return [('v', val) for val in doms[node[1]] if val != match_of_var[node[1]]]
+            if node[1] in match_of_val:
+                return [('x', match_of_val[node[1]])]
+            return []
+        def strongconnect(node):
+            index[node] = lowlink[node] = counter[0]
+            counter[0] += 1
+            tarjan_stack.append(node)
+            on_stack.add(node)
+            for succ in successors(node):
+                if not succ in index:
+                    strongconnect(succ)
+                    lowlink[node] = min(lowlink[node], lowlink[succ])
+                elif succ in on_stack:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            if lowlink[node] == index[node]:
+                while True:
+                    member = tarjan_stack.pop()
+                    on_stack.discard(member)
+                    component[member] = node
+                    if member == node:
+                        break
+        for i in range(len(self.scope)):
+            if not ('x', i) in index:
+                strongconnect(('x', i))
+
+        for i, var in enumerate(self.scope):
+            for val in doms[i]:
+                if (val == match_of_var[i] or val in free_reaching
+                        or component[('x', i)] == component.get(('v', val))):
+                    supported[var].add(val)
+        return supported
+
+    def has_support(self, var, val):
+        '''Test if var=val extends to an assignment of all different
+           current domain values (one matching computation; propagators
+           revising the whole scope should call supported_values once)'''
+        if not var.in_cur_domain(val):
+            return False
+        return val in self.supported_values()[var]
+
 class CSP:
     '''Class for packing up a set of variables into a CSP problem.
        Contains various utility routines for accessing the problem.
@@ -309,24 +624,38 @@ class CSP:
         self.vars = []
         self.cons = []
         self.vars_to_cons = dict()
+        #built by freeze: cons_with_var[var] is the tuple of constraints
+        #over var. It is kept here rather than on the variables, which
+        #other CSPs (e.g. the parts made by split) may share
+        self.frozen = False
+        self.cons_with_var = dict()
+        #number of constraints removed so far: consistency established
+        #before a removal may no longer hold (see BT.bt_resolve)
+        self.relaxations = 0
+        #undo information of the reductions made by reduce, latest last
+        self.reductions = []
+        #variables get_all_unasgn_vars is restricted to, None for all
+        #(see set_focus)
+        self.focus = None
         for v in vars:
             self.add_var(v)
 
     def add_var(self,v):
         '''Add variable object to CSP while setting up an index
            to obtain the constraints over this variable'''
-        if not type(v) is Variable:
+        if not isinstance(v, Variable):
             print("Trying to add non variable ", v, " to CSP object")
         elif v in self.vars_to_cons:
             print("Trying to add variable ", v, " to CSP object that already has it")
         else:
             self.vars.append(v)
             self.vars_to_cons[v] = []
+            self.unfreeze()
 
     def add_constraint(self,c):
         '''Add constraint to CSP. Note that all variables in the 
            constraints scope must already have been added to the CSP'''
-        if not type(c) is Constraint:
+        if not isinstance(c, Constraint):
             print("Trying to add non constraint ", c, " to CSP object")
         else:
             for v in c.scope:
@@ -335,13 +664,111 @@ class CSP:
                     return
                 self.vars_to_cons[v].append(c)
             self.cons.append(c)
+            self.unfreeze()
+
+    def remove_constraint(self,c):
+        '''Remove constraint from CSP, keeping the index of constraints
+           over each variable up to date'''
+        if not c in self.cons:
+            print("Trying to remove constraint ", c, " that is not in CSP object")
+        else:
+            #values and tuples removed by reduce may have been removed
+            #because of c, so they are put back
+            self.undo_reductions()
+            self.cons.remove(c)
+            for v in c.scope:
+                if c in self.vars_to_cons[v]:
+                    self.vars_to_cons[v].remove(c)
+            self.relaxations += 1
+            self.unfreeze()
+
+    def replace_constraint(self, old, new):
+        '''Put constraint new, over the same scope and with the same
+           satisfying tuples, in place of old (e.g. a table moved to a
+           TableStore, see table_store.py). The constraint keeps its
+           position in cons and in the index of constraints over each
+           variable, so the search is unchanged'''
+        if not old in self.cons:
+            print("Trying to replace constraint ", old, " that is not in CSP object")
+        elif tuple(new.scope) != tuple(old.scope):
+            print("Trying to replace constraint ", old, " by ", new, " over another scope")
+        else:
+            #the reductions made by reduce refer to old
+            self.undo_reductions()
+            self.cons[self.cons.index(old)] = new
+            for v in old.scope:
+                cons = self.vars_to_cons[v]
+                if old in cons:
+                    cons[cons.index(old)] = new
+            self.unfreeze()
+
+    def freeze(self):
+        '''Prepare the CSP for search: build the adjacency tuples
+           cons_with_var. While frozen, get_cons_with_var returns these
+           tuples without copying. Adding variables or constraints
+           unfreezes the CSP; bt_search freezes it again before searching.'''
+        self.cons_with_var = dict((v, tuple(self.vars_to_cons[v])) for v in self.vars)
+        self.frozen = True
+
+    def unfreeze(self):
+        '''Drop the adjacency tuples built by freeze'''
+        self.frozen = False
+        self.cons_with_var = dict()
+
+    def reduce(self):
+        '''Make the current domains permanent and remove from the tables
+           of the constraints every tuple using a pruned value. Meant to be
+           called once the root propagation is done (see BT.bt_search), so
+           that the search never scans those tuples again. Assignments are
+           ignored: only pruned values are dropped.
+           The reduction stays valid while constraints are only added;
+           remove_constraint undoes it (see undo_reductions).
+           Variables that cannot commit their current domain (see
+           IntRangeVariable.commit_cur_domain) get their pruned values back
+           with their domains, so the tables of the constraints over them
+           are left whole.
+           Returns (number of values removed, number of tuples removed)'''
+        old_doms = []
+        n_values = 0
+        uncommitted = set()
+        for v in self.vars:
+            if v.curdom_count < v.domain_size():
+                old_dom = v.commit_cur_domain()
+                if old_dom is None:
+                    uncommitted.add(v)
+                else:
+                    old_doms.append((v, old_dom))
+                    n_values += len(old_dom) - v.domain_size()
+        #the committed values are out of the domains, so tuples using them
+        #are no longer valid
+        removed_tuples = []
+        for c in self.cons:
+            if uncommitted and any(v in uncommitted for v in c.scope):
+                continue
+            removed = c.reduce_to_cur_domains()
+            if removed:
+                removed_tuples.append((c, removed))
+        self.reductions.append((old_doms, removed_tuples))
+        return n_values, sum(len(removed) for _, removed in removed_tuples)
+
+    def undo_reductions(self):
+        '''Put back the domain values and tuples removed by reduce'''
+        while self.reductions:
+            old_doms, removed_tuples = self.reductions.pop()
+            for v, old_dom in old_doms:
+                v.reset_domain(old_dom)
+            for c, removed in removed_tuples:
+                c.add_satisfying_tuples(removed)
 
     def get_all_cons(self):
         '''return list of all constraints in the CSP'''
         return self.cons
         
     def get_cons_with_var(self, var):
-        '''return list of constraints that include var in their scope'''
+        '''return list of constraints that include var in their scope
+           (a shared tuple, not a copy, when the CSP is frozen)'''
+        if self.frozen:
+            return self.cons_with_var[var]
         return list(self.vars_to_cons[var])
 
     def get_all_vars(self):
@@ -349,8 +776,78 @@ class CSP:
         return list(self.vars)
 
     def get_all_unasgn_vars(self):
-        '''return list of unassigned variables in the CSP'''
-        return [v for v in self.vars if not v.is_assigned()]
+        '''return list of unassigned variables in the CSP (of the focus
+           only, when one is set)'''
+        vars = self.vars if self.focus is None else self.focus
+        return [v for v in vars if not v.is_assigned()]
+
+    def set_focus(self, vars):
+        '''Restrict get_all_unasgn_vars, hence the variable ordering
+           heuristics, to vars, e.g. to the component being searched on
+           its own (see decomposition.py). None lifts the restriction.
+           Returns the previous focus, to be set back'''
+        old_focus = self.focus
+        self.focus = vars
+        return old_focus
+
+    def components(self, vars=None):
+        '''Split vars (by default the unassigned variables) into the
+           connected components of the constraint graph: two unassigned
+           variables are connected when some constraint has both in its
+           scope. Assigned variables are cut out of the graph, so that
+           assigning variables during search can split a component.
+           Returns a list of lists of variables, each in the order of vars'''
+        if vars is None:
+            vars = self.get_all_unasgn_vars()
+        component_of = dict()
+        for v in vars:
+            if not v.is_assigned():
+                component_of[v] = None
+        seen_cons = set()
+        n_components = 0
+        for v in vars:
+            if component_of.get(v, 0) is not None:
+                continue
+            component_of[v] = n_components
+            stack = [v]
+            while stack:
+                x = stack.pop()
+                for c in self.get_cons_with_var(x):
+                    if c in seen_cons:
+                        continue
+                    seen_cons.add(c)
+                    for y in c.scope:
+                        if y in component_of and component_of[y] is None:
+                            component_of[y] = n_components
+                            stack.append(y)
+            n_components += 1
+        components = [[] for _ in range(n_components)]
+        for v in vars:
+            if v in component_of:
+                components[component_of[v]].append(v)
+        return components
+
+    def split(self):
+        '''Split the CSP into independent CSPs, one per connected
+           component of its constraint graph (see components), sharing the
+           Variable and Constraint objects of this CSP. Meant to be called
+           before search, with no variable assigned. Returns the list of
+           parts'''
+        if any(v.is_assigned() for v in self.vars):
+            print("Trying to split CSP ", self.name, " that has assigned variables")
+            return [self]
+        components = self.components(self.vars)
+        parts = []
+        part_of = dict()
+        for i, component in enumerate(components):
+            part = CSP("{}_part{}".format(self.name, i+1), component)
+            for v in component:
+                part_of[v] = part
+            parts.append(part)
+        for c in self.cons:
+            if c.scope:
+                part_of[c.scope[0]].add_constraint(c)
+        return parts
 
     def print_all(self):
         print("CSP", self.name)
@@ -386,15 +883,34 @@ class BT:
         self.nPrunings  = 0 #nPrunings is the number of value prunings during search
         unasgn_vars = list() #used to track unassigned variables
         self.TRACE = False
+        self.events = None  #event sink the search is reported to, see search_events.py
+        self.strategy = None #tree search strategy, see search_strategies.py; None for depth-first
         self.runtime = 0
+        #kept between searches for bt_resolve
+        self.last_solution = dict() #var --> value of the last solution found
+        self.root_prunings = []     #root prunings of the last search
+        self.root_relaxations = None #csp.relaxations when they were found
 
     def trace_on(self):
-        '''Turn search trace on'''
+        '''Turn search trace on: search events are printed'''
         self.TRACE = True
+        self.events = PrintEventSink()
 
     def trace_off(self):
         '''Turn search trace off'''
         self.TRACE = False
+        self.events = None
+
+    def log_events(self, sink):
+        '''Report search events to sink (see search_events.py), e.g. a
+           JSONLinesSink or BinaryEventSink. None turns logging off.'''
+        self.events = sink
+
+    def set_strategy(self, strategy):
+        '''Explore the search tree of bt_search and bt_resolve with
+           strategy (see search_strategies.py), e.g. lds. None restores
+           plain depth-first search (bt_recurse).'''
+        self.strategy = strategy
 
         
     def clear_stats(self):
@@ -424,7 +940,7 @@ class BT:
         '''Add variable back to list of unassigned vars'''
         self.unasgn_vars.append(var)
         
-    def bt_search(self,propagator,var_ord=None,val_ord=None):
+    def bt_search(self,propagator,var_ord=None,val_ord=None,reduce_root=False):
         '''Try to solve the CSP using specified propagator routine
 
            propagator == a function with the following template
@@ -458,10 +974,34 @@ class BT:
 
            var_ord is the variable ordering function currently being used; 
            val_ord is the value ordering function currently being used.
+
+           If reduce_root is True, the values pruned by the root propagation
+           are removed for good, together with the table tuples using them
+           (see CSP.reduce), so that no node of the search scans them again.
+
+           Returns True if a solution was found (it is left assigned to the
+           variables of the CSP), False otherwise.
            '''
 
-        self.clear_stats()
         stime = time.process_time()
+        status, prunings = self.start_search(propagator, reduce_root=reduce_root)
+        if status:
+            status = self.search_tree(propagator, var_ord, val_ord)   #now do recursive search
+        self.finish_search(propagator, status, prunings, stime)
+        return status
+
+    def start_search(self, propagator, seed_prunings=[], reduce_root=False):
+        '''Internal routine shared by bt_search and bt_search_async. Reset
+           statistics and domains, set up the unassigned variable list and
+           run the propagator at the root. seed_prunings are (var, val)
+           pairs pruned before the propagator runs (see bt_resolve). If
+           reduce_root is True the root prunings are made permanent with
+           CSP.reduce, and there is nothing left to restore.
+           Returns (status, root prunings to restore)'''
+        self.clear_stats()
+
+        if not self.csp.frozen:
+            self.csp.freeze()
 
         self.restore_all_variable_domains()
         
@@ -470,23 +1010,103 @@ class BT:
             if not v.is_assigned():
                 self.unasgn_vars.append(v)
 
-        status, prunings = propagator(self.csp) #initial propagate no assigned variables.
-        self.nPrunings = self.nPrunings + len(prunings)
-
-        if self.TRACE:
-            print(len(self.unasgn_vars), " unassigned variables at start of search")
-            print("Root Prunings: ", prunings)
+        seeded = []
+        status = True
+        for var, val in seed_prunings:
+            if var in self.csp.vars_to_cons and var.in_cur_domain(val):
+                var.prune_value(val)
+                seeded.append((var, val))
+                if var.cur_domain_size() == 0:
+                    status = False
+
+        prunings = []
+        if status:
+            status, prunings = propagator(self.csp) #initial propagate no assigned variables.
+            self.nPrunings = self.nPrunings + len(prunings)
+        prunings = seeded + prunings
+        self.root_prunings = prunings
+        self.root_relaxations = self.csp.relaxations
+
+        if self.events:
+            self.events.emit('start', 0, val=len(self.unasgn_vars))
+            self.events.emit('root', 0, status=status, prunings=prunings)
 
         if status == False:
             print("CSP{} detected contradiction at root".format(
                 self.csp.name))
+        elif reduce_root:
+            n_values, n_tuples = self.csp.reduce()
+            print("Root reduction removed {} domain values and {} tuples".format(n_values, n_tuples))
+            prunings = []
+            self.root_prunings = []
+        return status, prunings
+
+    def search_tree(self, propagator, var_ord, val_ord):
+        '''Internal routine. Search below the root with the strategy set
+           by set_strategy, depth-first (bt_recurse) by default'''
+        if self.strategy is None:
+            return self.bt_recurse(propagator, var_ord, val_ord, 1)
+        return self.strategy(self, propagator, var_ord, val_ord)
+
+    #
+    #steps of the tree search, for the strategies of search_strategies.py
+    #
+
+    def select_var(self, var_ord):
+        '''Pick the next variable to assign (with var_ord, else the first
+           unassigned one) and remove it from the unassigned variables'''
+        if var_ord:
+            var = var_ord(self.csp)
         else:
-            status = self.bt_recurse(propagator, var_ord, val_ord, 1)   #now do recursive search
+            var = self.unasgn_vars[0]
+        self.unasgn_vars.remove(var)
+        return var
+
+    def ordered_values(self, var, val_ord):
+        '''The values of var to try, best first'''
+        if val_ord:
+            return val_ord(self.csp, var)
+        return var.cur_domain()
+
+    def try_value(self, propagator, var, val, level):
+        '''Assign val to var and propagate. Returns (status, prunings)
+           as the propagator; undo_value must be called to take the
+           assignment back, whatever the status'''
+        if self.events:
+            self.events.emit('decision', level, var, val)
+        var.assign(val)
+        self.nDecisions = self.nDecisions+1
+        status, prunings = propagator(self.csp, var)
+        self.nPrunings = self.nPrunings + len(prunings)
+        if self.events:
+            self.events.emit('propagate', level, var, val, status=status)
+            self.events.emit('prune', level, prunings=prunings)
+        return status, prunings
 
+    def undo_value(self, var, prunings):
+        '''Take back an assignment made by try_value'''
         self.restoreValues(prunings)
+        var.unassign()
+
+    def release_var(self, var, level):
+        '''Give back a variable taken by select_var, after all the values
+           tried for it failed'''
+        if self.events:
+            self.events.emit('backtrack', level, var)
+        self.restoreUnasgnVar(var)
+
+    def finish_search(self, propagator, status, prunings, stime):
+        '''Internal routine shared by bt_search and bt_search_async. Undo
+           the root prunings, release the propagator and report the
+           outcome of the search'''
+        self.restoreValues(prunings)
+        self.release_propagator(propagator)
+        if self.events:
+            self.events.emit('end', 0, status=status)
         if status == False:
             print("CSP{} unsolved. Has no solutions".format(self.csp.name))
         if status == True:
+            self.last_solution = dict((v, v.get_assigned_value()) for v in self.csp.vars)
             print("CSP {} solved. CPU Time used = {}".format(self.csp.name,
                                                              time.process_time() - stime))
             self.csp.print_soln()
@@ -494,15 +1114,124 @@ class BT:
         print("bt_search finished")
         self.print_stats()
 
+    def release_propagator(self, propagator):
+        '''Internal routine. Detach a propagator that listens to the
+           variables of the CSP (see propagation_engine.py), so that it
+           stops receiving their events once the search is over'''
+        detach = getattr(propagator, 'detach', None)
+        if detach is not None:
+            detach()
+
+    def bt_resolve(self, propagator, var_ord=None, val_ord=None, reduce_root=False):
+        '''Solve the CSP again after it was edited (constraints added with
+           CSP.add_constraint or removed with CSP.remove_constraint), reusing
+           the work of the previous search:
+
+           - the previous solution is used as a value ordering hint: for each
+             variable its previous value is tried first, the remaining values
+             follow in the order given by val_ord.
+           - if constraints were only added since the previous search, its
+             root prunings are still valid, so they are applied before the
+             root propagation rather than rediscovered. Removing a
+             constraint discards them: the search compares CSP.relaxations
+             with its value when they were found, so a removal is noticed
+             whichever BT object searched the CSP since.
+
+           Otherwise behaves as bt_search, and returns the same. reduce_root
+           is as for bt_search; the reduction also covers the seeded root
+           prunings.'''
+        hint = self.last_solution
+
+        def hinted_val_ord(csp, var):
+            if val_ord:
+                values = val_ord(csp, var)
+            else:
+                values = var.cur_domain()
+            if var in hint and hint[var] in values:
+                values = [hint[var]] + [val for val in values if val != hint[var]]
+            return values
+
+        if self.root_relaxations == self.csp.relaxations:
+            seed_prunings = self.root_prunings
+        else:
+            seed_prunings = []
+
+        stime = time.process_time()
+        status, prunings = self.start_search(propagator, seed_prunings, reduce_root=reduce_root)
+        if status:
+            status = self.search_tree(propagator, var_ord, hinted_val_ord)
+        self.finish_search(propagator, status, prunings, stime)
+        return status
+
+    async def bt_search_async(self, propagator, var_ord=None, val_ord=None, yield_every=100, reduce_root=False):
+        '''Coroutine version of bt_search for use inside an asyncio event
+           loop. Search is the same, but control is handed back to the loop
+           (await asyncio.sleep(0)) every yield_every variable assignments,
+           so many solves can share one loop without blocking it.
+
+           The solve can be stopped by cancelling the task running it: the
+           CancelledError propagates out after all variables of the CSP are
+           unassigned and their domains restored, the propagator released
+           and an 'end' event with status None emitted.
+
+           Returns True if a solution was found (it is left assigned to the
+           variables, as with bt_search), False otherwise. Two concurrent
+           solves must not share Variable objects. reduce_root is as for
+           bt_search.
+
+           Only depth-first search is supported: the strategies of
+           search_strategies.py never hand control back to the loop. If a
+           strategy is set (set_strategy), an error is printed and None is
+           returned without searching.'''
+        if self.strategy is not None:
+            print("ERROR: bt_search_async does not support search strategies; call set_strategy(None) or use bt_search")
+            return None
+        stime = time.process_time()
+        status, prunings = self.start_search(propagator, reduce_root=reduce_root)
+        finished = False
+        try:
+            if status:
+                status = await self.bt_recurse_async(propagator, var_ord, val_ord, 1, yield_every)
+            finished = True
+        finally:
+            if not finished:
+                #cancelled (or failed) in the middle of the search
+                self.restore_all_variable_domains()
+                self.release_propagator(propagator)
+                if self.events:
+                    self.events.emit('end', 0, status=None)
+        self.finish_search(propagator, status, prunings, stime)
+        return status
+
+    async def bt_recurse_async(self, propagator, var_ord, val_ord, level, yield_every):
+        '''bt_recurse for bt_search_async: the same depth-first search,
+           built from the steps the strategies use, that yields to the event
+           loop every yield_every decisions'''
+        if not self.unasgn_vars:
+            if self.events:
+                self.events.emit('solution', level)
+            return True
+
+        var = self.select_var(var_ord)
+        for val in self.ordered_values(var, val_ord):
+            status, prunings = self.try_value(propagator, var, val, level)
+            if self.nDecisions % yield_every == 0:
+                await asyncio.sleep(0)
+            if status:
+                if await self.bt_recurse_async(propagator, var_ord, val_ord, level+1, yield_every):
+                    return True
+            self.undo_value(var, prunings)
+        self.release_var(var, level)
+        return False
+
     def bt_recurse(self, propagator, var_ord, val_ord, level):
         '''Return true if found solution. False if still need to search.
            If top level returns false--> no solution'''
 
-        if self.TRACE:
-            print('  ' * level, "bt_recurse level ", level)
-           
         if not self.unasgn_vars:
             #all variables assigned
+            if self.events:
+                self.events.emit('solution', level)
             return True
         else:
             ##Figure out which variable to assign,
@@ -513,9 +1242,6 @@ class BT:
               var = self.unasgn_vars[0]
             self.unasgn_vars.remove(var) 
 
-            if self.TRACE:
-                print('  ' * level, "bt_recurse var = ", var)
-
             if val_ord:
               value_order = val_ord(self.csp,var)
             else:
@@ -523,8 +1249,8 @@ class BT:
 
             for val in value_order:
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse trying", var, "=", val)
+                if self.events:
+                    self.events.emit('decision', level, var, val)
 
                 var.assign(val)
                 self.nDecisions = self.nDecisions+1
@@ -532,19 +1258,18 @@ class BT:
                 status, prunings = propagator(self.csp, var)
                 self.nPrunings = self.nPrunings + len(prunings)
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse prop status = ", status)
-                    print('  ' * level, "bt_recurse prop pruned = ", prunings)
+                if self.events:
+                    self.events.emit('propagate', level, var, val, status=status)
+                    self.events.emit('prune', level, prunings=prunings)
 
                 if status:
                     if self.bt_recurse(propagator, var_ord,val_ord, level+1):
                         return True
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse restoring ", prunings)
                 self.restoreValues(prunings)
                 var.unassign()
 
+            if self.events:
+                self.events.emit('backtrack', level, var)
             self.restoreUnasgnVar(var)
             return False
-
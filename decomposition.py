@@ -0,0 +1,215 @@
+'''
+This file contains the decomposition of a CSP into the connected components
+of its constraint graph (see CSP.components), so that independent parts of
+a problem are solved independently.
+
+Depth-first search treats a CSP whose constraint graph is split as a single
+problem: a dead end in one part makes it backtrack over the assignments of
+the other parts, which are then searched again for nothing, and counting
+solutions enumerates the product of the solutions of the parts one by one.
+Assigning variables cuts them out of the graph, so a connected CSP can
+split during search as well.
+
+    component_search   tree search strategy for BT.set_strategy (see
+                       search_strategies.py): at every node the unassigned
+                       variables are split into components, each searched
+                       on its own; a component without solution fails the
+                       node at once
+    count_solutions    number of solutions of a CSP, the product over the
+                       components of their numbers of solutions
+    solve_components   splits the CSP into independent CSPs (CSP.split)
+                       and solves them one by one, or in a pool of
+                       processes
+
+For example
+
+    solver = BT(csp)
+    solver.set_strategy(component_search)
+    solver.bt_search(prop_GAC, ord_mrv, val_lcv)
+
+Components are searched with the variable ordering restricted to them (see
+CSP.set_focus), so var_ord must pick its variable among
+csp.get_all_unasgn_vars(), as the heuristics of heuristics.py do.
+'''
+import time
+import concurrent.futures
+
+from cspbase import BT
+
+def component_search(bt, propagator, var_ord, val_ord):
+    """
+
+    :param bt: the BT object searching
+    :return: True iff a solution was found (it is left assigned)
+    """
+    old_focus = bt.csp.focus
+    try:
+        status = search_components(bt, propagator, var_ord, val_ord, 1, [])
+    finally:
+        bt.csp.set_focus(old_focus)
+    if status and bt.events:
+        bt.events.emit('solution', len(bt.csp.vars))
+    return status
+
+def search_components(bt, propagator, var_ord, val_ord, level, trail):
+    '''Internal routine. Assign the variables of bt.unasgn_vars, one
+       component after the other. On success the assignments made are
+       pushed on trail as (var, prunings) pairs, so that a caller whose
+       later component fails can take them back; on failure everything
+       done here is undone.'''
+    components = bt.csp.components(bt.unasgn_vars)
+    if len(components) <= 1:
+        return search_component(bt, propagator, var_ord, val_ord, level, trail)
+
+    unasgn_vars = bt.unasgn_vars
+    focus = bt.csp.focus
+    mark = len(trail)
+    status = True
+    for component in components:
+        bt.unasgn_vars = list(component)
+        bt.csp.set_focus(component)
+        #the components solved before stay assigned: the level is the
+        #number of assignments on the path, as in bt_recurse
+        if not search_component(bt, propagator, var_ord, val_ord, len(trail) + 1, trail):
+            status = False
+            break
+    bt.csp.set_focus(focus)
+    if status:
+        bt.unasgn_vars = []
+    else:
+        #the components solved so far are of no use
+        while len(trail) > mark:
+            var, prunings = trail.pop()
+            bt.undo_value(var, prunings)
+        bt.unasgn_vars = unasgn_vars
+    return status
+
+def search_component(bt, propagator, var_ord, val_ord, level, trail):
+    '''Internal routine. Depth-first search of a single component, which
+       is decomposed again below every assignment'''
+    if not bt.unasgn_vars:
+        return True
+    var = bt.select_var(var_ord)
+    for val in bt.ordered_values(var, val_ord):
+        status, prunings = bt.try_value(propagator, var, val, level)
+        if status:
+            trail.append((var, prunings))
+            if search_components(bt, propagator, var_ord, val_ord, level+1, trail):
+                return True
+            trail.pop()
+        bt.undo_value(var, prunings)
+    bt.release_var(var, level)
+    return False
+
+def count_solutions(csp, propagator, var_ord=None, val_ord=None, decompose=True):
+    """
+
+    :param csp: the CSP whose solutions are counted
+    :param propagator: the propagator run at every node, as for bt_search
+    :param decompose: if False the solutions are enumerated one by one, without splitting into components
+    :return: the number of solutions of csp; its variables are left unassigned
+    """
+    bt = BT(csp)
+    stime = time.process_time()
+    status, prunings = bt.start_search(propagator)
+    n_solutions = 0
+    if status:
+        focus = csp.set_focus(None)
+        try:
+            n_solutions = count_components(bt, propagator, var_ord, val_ord, 1, decompose)
+        finally:
+            csp.set_focus(focus)
+    bt.restoreValues(prunings)
+    bt.release_propagator(propagator)
+    if bt.events:
+        bt.events.emit('end', 0, status=n_solutions > 0)
+    print("CSP {} has {} solutions. CPU Time used = {}".format(csp.name, n_solutions,
+                                                               time.process_time() - stime))
+    bt.print_stats()
+    return n_solutions
+
+def count_components(bt, propagator, var_ord, val_ord, level, decompose):
+    '''Internal routine. Number of solutions of the variables of
+       bt.unasgn_vars, with everything undone on return'''
+    if not bt.unasgn_vars:
+        return 1
+    if not decompose:
+        return count_component(bt, propagator, var_ord, val_ord, level, decompose)
+
+    unasgn_vars = bt.unasgn_vars
+    focus = bt.csp.focus
+    n_solutions = 1
+    for component in bt.csp.components(unasgn_vars):
+        bt.unasgn_vars = list(component)
+        bt.csp.set_focus(component)
+        n_solutions *= count_component(bt, propagator, var_ord, val_ord, level, decompose)
+        if n_solutions == 0:
+            break
+    bt.csp.set_focus(focus)
+    bt.unasgn_vars = unasgn_vars
+    return n_solutions
+
+def count_component(bt, propagator, var_ord, val_ord, level, decompose):
+    '''Internal routine. Sum of the numbers of solutions below every value
+       of the next variable'''
+    var = bt.select_var(var_ord)
+    n_solutions = 0
+    for val in bt.ordered_values(var, val_ord):
+        status, prunings = bt.try_value(propagator, var, val, level)
+        if status:
+            n_solutions += count_components(bt, propagator, var_ord, val_ord, level+1, decompose)
+        bt.undo_value(var, prunings)
+    bt.release_var(var, level)
+    return n_solutions
+
+def solve_part(part, propagator, var_ord, val_ord):
+    '''Internal. Solve one part of a split CSP, in this process or in a
+       worker. Return the values of its variables in order (they are left
+       unassigned), None if it has no solution'''
+    solver = BT(part)
+    if not solver.bt_search(propagator, var_ord, val_ord):
+        return None
+    solution = [var.get_assigned_value() for var in part.vars]
+    solver.restore_all_variable_domains()
+    return solution
+
+def solve_components(csp, propagator, var_ord=None, val_ord=None, processes=None):
+    """
+
+    :param csp: the CSP to solve, with no variable assigned
+    :param propagator: the propagator, as for bt_search
+    :param processes: if greater than 1, the components are solved in a pool of that many processes; propagator,
+                      var_ord and val_ord must then be picklable (module level functions or objects)
+    :return: True iff a solution was found; it is left assigned to the variables of csp. The search stops as soon
+             as one component is found to have no solution.
+    """
+    parts = csp.split()
+    solutions = [None] * len(parts)
+    failed = None
+    if processes and processes > 1 and len(parts) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = dict((pool.submit(solve_part, part, propagator, var_ord, val_ord), i)
+                           for i, part in enumerate(parts))
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                solutions[i] = future.result()
+                if solutions[i] is None:
+                    failed = i
+                    for other in futures:
+                        other.cancel()
+                    break
+    else:
+        for i, part in enumerate(parts):
+            solutions[i] = solve_part(part, propagator, var_ord, val_ord)
+            if solutions[i] is None:
+                failed = i
+                break
+
+    if failed is not None:
+        print("CSP{} unsolved. Its component {} has no solutions".format(csp.name, parts[failed].name))
+        return False
+    for part, solution in zip(parts, solutions):
+        for var, val in zip(part.vars, solution):
+            var.assign(val)
+    print("CSP {} solved in {} components".format(csp.name, len(parts)))
+    return True
@@ -0,0 +1,179 @@
+'''
+This file contains a solution cache placed in front of kenken_csp_model and
+BT, so that boards submitted again (possibly with their cages, or the
+cells of a cage, listed in a different order) skip model construction and
+search entirely.
+
+Boards are keyed on a canonical form: the cells of every cage are sorted,
+and so are the cages. Solutions are kept in a bounded in-memory LRU
+backed, optionally, by an on-disk sqlite3 store that outlives the
+process. Any cached solution is validated against the board's constraints
+(rows and columns all-different, cage arithmetic) before it is returned;
+an invalid entry is dropped and the board solved again. Boards found to
+have no solution are cached too (as UNSOLVABLE, NULL on disk), so they are
+not searched again; such an entry cannot be validated and is trusted.
+
+For example
+
+    cache = SolutionCache("solutions.db")
+    solution = cache.solve(board)   #list of rows of values, None if unsolvable
+'''
+import io
+import json
+import hashlib
+import sqlite3
+import contextlib
+from collections import OrderedDict
+
+from cspbase import *
+from propagators import prop_GAC
+from heuristics import ord_mrv
+from kenken_csp import kenken_csp_model, decode_cages, cage_satisfied, cell_coord
+
+#cached in place of the solution of a board that has none
+UNSOLVABLE = 'unsolvable'
+
+def canonical_board(kenken_grid):
+    """
+
+    :param kenken_grid: a list of list, first element being the size of the kenken grid board, rest are cage constraitns
+    :return: the canonical form of the board, a string identical for boards differing only in the order of their
+             cages or of the cells inside a cage, or in the encoding of the cells (see cell_coord)
+    """
+    size = kenken_grid[0][0]
+    cages = []
+    for cur_cage in kenken_grid[1:]:
+        cells = sorted(cell_coord(cell) for cell in cur_cage[:-2])
+        if size <= 9:
+            cells = [(row_index+1)*10 + (col_index+1) for (row_index, col_index) in cells]
+        else:
+            cells = [[row_index+1, col_index+1] for (row_index, col_index) in cells]
+        cages.append(cells + list(cur_cage[-2:]))
+    cages.sort()
+    return json.dumps([kenken_grid[0][0]] + cages, separators=(',', ':'))
+
+def board_key(kenken_grid):
+    """
+
+    :param kenken_grid: a list of list, first element being the size of the kenken grid board, rest are cage constraitns
+    :return: a fixed length hex digest of the canonical form of the board
+    """
+    return hashlib.sha256(canonical_board(kenken_grid).encode('utf-8')).hexdigest()
+
+def solution_satisfies_board(kenken_grid, solution):
+    """
+
+    :param kenken_grid: a list of list, first element being the size of the kenken grid board, rest are cage constraitns
+    :param solution: a list of lists of values, solution[i][j] being the value of the cell in row i+1, column j+1
+    :return: True iff "solution" satisfies every row, column and cage constraint of the board
+    """
+    size = kenken_grid[0][0]
+    var_dom = list(range(1, size+1))
+    if len(solution) != size or any(len(row) != size for row in solution):
+        return False
+    for row in solution:
+        if sorted(row) != var_dom:
+            return False
+    for j in range(size):
+        if sorted(solution[i][j] for i in range(size)) != var_dom:
+            return False
+    for caged_variables, operation, expected_output in decode_cages(kenken_grid):
+        vals = [solution[row_index][col_index] for (row_index, col_index) in caged_variables]
+        if not cage_satisfied(vals, operation, expected_output):
+            return False
+    return True
+
+class SolutionCache:
+    '''Bounded LRU of board solutions, keyed on board_key, with an optional
+       sqlite3 file behind it. Entries evicted from memory stay on disk.'''
+
+    def __init__(self, path=None, capacity=1024):
+        '''path == sqlite3 file of the persistent store, None to keep the
+           cache in memory only. capacity == maximum number of solutions
+           kept in memory'''
+        self.capacity = capacity
+        self.memory = OrderedDict()
+        self.nHits = 0
+        self.nMisses = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, solution TEXT)")
+            self.db.commit()
+
+    def remember(self, key, solution):
+        '''Internal routine. Put solution in the in-memory LRU'''
+        self.memory[key] = solution
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def forget(self, key):
+        '''Internal routine. Drop key from memory and disk'''
+        self.memory.pop(key, None)
+        if self.db is not None:
+            self.db.execute("DELETE FROM solutions WHERE key = ?", (key,))
+            self.db.commit()
+
+    def get(self, kenken_grid):
+        '''return the cached and validated solution of the board,
+           UNSOLVABLE if the board is cached as having no solution, None if
+           there is no entry'''
+        key = board_key(kenken_grid)
+        solution = None
+        if key in self.memory:
+            solution = self.memory[key]
+            self.memory.move_to_end(key)
+        elif self.db is not None:
+            row = self.db.execute("SELECT solution FROM solutions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                solution = UNSOLVABLE if row[0] is None else json.loads(row[0])
+                self.remember(key, solution)
+        if solution is not None and solution is not UNSOLVABLE and not solution_satisfies_board(kenken_grid, solution):
+            self.forget(key)
+            solution = None
+        if solution is None:
+            self.nMisses += 1
+        else:
+            self.nHits += 1
+        return solution
+
+    def put(self, kenken_grid, solution):
+        '''store the solution of the board (UNSOLVABLE if it has none) in
+           memory and on disk'''
+        key = board_key(kenken_grid)
+        if solution is not UNSOLVABLE:
+            solution = [list(row) for row in solution]
+        self.remember(key, solution)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO solutions (key, solution) VALUES (?, ?)",
+                            (key, None if solution is UNSOLVABLE else json.dumps(solution)))
+            self.db.commit()
+
+    def solve(self, kenken_grid, propagator=prop_GAC, var_ord=ord_mrv, val_ord=None):
+        '''return the solution of the board from the cache, or else build
+           kenken_csp_model, solve it with BT (output silenced), cache and
+           return the solution. Returns None if the board has no solution'''
+        solution = self.get(kenken_grid)
+        if solution is UNSOLVABLE:
+            return None
+        if solution is not None:
+            return solution
+
+        csp, board = kenken_csp_model(kenken_grid)
+        solver = BT(csp)
+        with contextlib.redirect_stdout(io.StringIO()):
+            status = solver.bt_search(propagator, var_ord, val_ord)
+        if not status:
+            self.put(kenken_grid, UNSOLVABLE)
+            return None
+        solution = [[var.get_assigned_value() for var in row] for row in board]
+        solver.restore_all_variable_domains()
+        self.put(kenken_grid, solution)
+        return solution
+
+    def close(self):
+        '''close the persistent store'''
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -30,7 +30,37 @@ The grid-only models do not need to encode the cage constraints.
 
 '''
 from cspbase import *
+from mdd import MDDConstraint, mdd_from_transitions
 import itertools
+import concurrent.futures
+
+#cages whose table would have to be filtered out of more candidate tuples than this (size ** number of cells)
+#are CageConstraint objects when kenken_csp_model chooses the cage representation itself
+CAGE_TABLE_LIMIT = 10**4
+
+def cell_coord(cell):
+    """
+
+    :param cell: a cell of a cage, either a pair (row, col) or, for boards up to 9x9, the integer row*10+col
+                 (rows and columns counted from 1 in both cases)
+    :return: (row_index, col_index) of the cell, counted from 0
+    """
+    if isinstance(cell, int):
+        return (cell//10-1, cell%10-1)
+    return (cell[0]-1, cell[1]-1)
+
+def var_name(row_index, col_index, size):
+    """
+
+    :param row_index: row of the cell, counted from 0
+    :param col_index: column of the cell, counted from 0
+    :param size: size of the board
+    :return: the name of the variable of the cell, eg. Var_12 for row 1, column 2; the row and column are
+             separated (Var_1_12) on boards larger than 9x9, where the short form would be ambiguous
+    """
+    if size <= 9:
+        return "Var_{}{}".format(row_index+1, col_index+1)
+    return "Var_{}_{}".format(row_index+1, col_index+1)
 
 def binary_ne_grid(kenken_grid):
     """
@@ -55,7 +85,7 @@ def binary_ne_grid(kenken_grid):
     #variables will be named after their coordinates, eg. V_11 = BOARD[0][0]
     for i in range(size):
         for j in range(size):
-            var = Variable("Var_{}{}".format(i+1, j+1))
+            var = Variable(var_name(i, j, size))
             var.add_domain_values(var_dom)
             board[i][j] = var
             all_Vars.append(var)
@@ -64,13 +94,12 @@ def binary_ne_grid(kenken_grid):
     kenken_csp = CSP("binary_kenken_csp", all_Vars)
 
     #binary-constraints initialization, from line to line
-    satisfying_tuples = list(itertools.permutations(var_dom, 2))
+    #not-equal constraints need no table of satisfying tuples
     #row constraints
     for i in range(size):
         row_scope_pool = list(itertools.combinations(board[i], 2))
         for scope in row_scope_pool:
-            row_constraint = Constraint("Row_Diff-({}, {})".format(scope[0].name, scope[1].name), scope)
-            row_constraint.add_satisfying_tuples(satisfying_tuples)
+            row_constraint = NotEqualConstraint("Row_Diff-({}, {})".format(scope[0].name, scope[1].name), scope)
             kenken_csp.add_constraint(row_constraint)
 
     #column constraints
@@ -83,17 +112,33 @@ def binary_ne_grid(kenken_grid):
     for i in range(size):
         col_scope_pool = list(itertools.combinations(board_Transpose[i], 2))
         for scope in col_scope_pool:
-            col_constraint = Constraint("Col_Diff-({}, {})".format(scope[0].name, scope[1].name), scope)
-            col_constraint.add_satisfying_tuples(satisfying_tuples)
+            col_constraint = NotEqualConstraint("Col_Diff-({}, {})".format(scope[0].name, scope[1].name), scope)
             kenken_csp.add_constraint(col_constraint)
 
     return kenken_csp, board
 
 
-def nary_ad_grid(kenken_grid):
+def alldiff_mdd(var_dom, size):
+    """
+
+    :param var_dom: the domain of every variable
+    :param size: number of variables
+    :return: an MDD accepting the tuples of "size" pairwise different values of "var_dom"; its nodes are the sets
+             of values used so far, so it has at most 2^len(var_dom) nodes instead of the permutation table
+    """
+    def transition(i, used, val):
+        if val in used:
+            return None
+        return used | frozenset([val])
+    return mdd_from_transitions([var_dom] * size, frozenset(), transition)
+
+def nary_ad_grid(kenken_grid, mdd=False, native=None):
     """
 
     :param kenken_grid: a list of list, first element being the size of the kenken grid board, rest are cage constraitns
+    :param mdd: if True the all-different constraints are MDDConstraint objects instead of permutation tables
+    :param native: if True the all-different constraints are AllDiffConstraint objects, with no table nor MDD; if
+                   None they are for boards larger than 9x9, whose permutation tables cannot be built
     :return: the kenken csp and the kenken_grid board containing all variables
     """
 
@@ -102,6 +147,8 @@ def nary_ad_grid(kenken_grid):
     var_dom = []
     for i in range(size):
         var_dom.append(i + 1)
+    if native is None:
+        native = size > 9 and not mdd
     all_Vars = []
 
     # initialize the board
@@ -113,7 +160,7 @@ def nary_ad_grid(kenken_grid):
     # variables will be named after their coordinates, eg. V_11 = BOARD[0][0]
     for i in range(size):
         for j in range(size):
-            var = Variable("Var_{}{}".format(i + 1, j + 1))
+            var = Variable(var_name(i, j, size))
             var.add_domain_values(var_dom)
             board[i][j] = var
             all_Vars.append(var)
@@ -122,11 +169,22 @@ def nary_ad_grid(kenken_grid):
     kenken_csp = CSP("nary_kenken_csp", all_Vars)
 
     # binary-constraints initialization, from line to line
-    satisfying_tuples = list(itertools.permutations(var_dom, size))
+    if native:
+        #AllDiffConstraint objects need neither a table nor an MDD
+        pass
+    elif mdd:
+        alldiff = alldiff_mdd(var_dom, size)
+    else:
+        satisfying_tuples = list(itertools.permutations(var_dom, size))
     # row constraints
     for i in range(size):
-        row_constraint = Constraint("Row_Diff_{}".format(i+1), board[i])
-        row_constraint.add_satisfying_tuples(satisfying_tuples)
+        if native:
+            row_constraint = AllDiffConstraint("Row_Diff_{}".format(i+1), board[i])
+        elif mdd:
+            row_constraint = MDDConstraint("Row_Diff_{}".format(i+1), board[i], alldiff)
+        else:
+            row_constraint = Constraint("Row_Diff_{}".format(i+1), board[i])
+            row_constraint.add_satisfying_tuples(satisfying_tuples)
         kenken_csp.add_constraint(row_constraint)
 
     # column constraints
@@ -137,8 +195,13 @@ def nary_ad_grid(kenken_grid):
         for j in range(size):
             board_Transpose[i][j] = board[j][i]
     for i in range(size):
-        col_constraint = Constraint("Col_Diff_{}".format(i+1), board_Transpose[i])
-        col_constraint.add_satisfying_tuples(satisfying_tuples)
+        if native:
+            col_constraint = AllDiffConstraint("Col_Diff_{}".format(i+1), board_Transpose[i])
+        elif mdd:
+            col_constraint = MDDConstraint("Col_Diff_{}".format(i+1), board_Transpose[i], alldiff)
+        else:
+            col_constraint = Constraint("Col_Diff_{}".format(i+1), board_Transpose[i])
+            col_constraint.add_satisfying_tuples(satisfying_tuples)
         kenken_csp.add_constraint((col_constraint))
 
     return kenken_csp, board
@@ -177,28 +240,205 @@ def exist_satisfying_permutation(potential_sol, operation, expected_output):
             return True
     return False
 
-def cage_constraint(board, cage, cage_index):
+def reachable_sums(domains, limit):
     """
 
-    :param board: board[0][0] is the variable representing value of upper most cell
-    :param cage: a list representing one cage constraint
-    :param cage_index: index of the cage constraint this function returns
-    :return: a cage constraint based on parameter "cage"
+    :param domains: a list of domains (lists of positive integers), one for each variable
+    :param limit: partial sums greater than "limit" are discarded
+    :return: the set of sums no greater than "limit" obtainable by picking one value from each domain
+    """
+    reached = {0}
+    for dom in domains:
+        reached = {r + v for r in reached for v in dom if r + v <= limit}
+        if not reached:
+            break
+    return reached
+
+def reachable_products(domains, limit):
+    """
+
+    :param domains: a list of domains (lists of positive integers), one for each variable
+    :param limit: only partial products dividing "limit" are kept (divisor filtering)
+    :return: the set of divisors of "limit" obtainable as a product of one value from each domain
+    """
+    reached = {1}
+    for dom in domains:
+        reached = {r * v for r in reached for v in dom if limit % (r * v) == 0}
+        if not reached:
+            break
+    return reached
+
+def cage_line_pairs(caged_variables):
+    """
+
+    :param caged_variables: a list of (row_index, col_index) coordinates of the cells in a cage
+    :return: a list of (i, j) index pairs, i < j, of cage cells that share a row or a column and so must differ
+    """
+    line_pairs = []
+    for i, j in itertools.combinations(range(len(caged_variables)), 2):
+        if caged_variables[i][0] == caged_variables[j][0] or caged_variables[i][1] == caged_variables[j][1]:
+            line_pairs.append((i, j))
+    return line_pairs
+
+def cage_satisfied(vals, operation, expected_output):
+    """
+
+    :param vals: the values of the cells of a cage
+    :param operation: 0: plus; 1: minus; 2: divide; 3: multiply
+    :param expected_output: expected output of the cage constraint
+    :return: True iff "vals" satisfy the cage, with the semantics of exist_satisfying_permutation for minus and
+             divide: some cell combined with all the other cells yields "expected_output"
+    """
+    if operation == 0: #plus
+        return sum(vals) == expected_output
+    elif operation == 3: #multiply
+        product = 1
+        for val in vals:
+            product *= val
+        return product == expected_output
+    elif operation == 1: #minus: first - (sum of rest) == expected_output
+        total = sum(vals)
+        return any(2*val - total == expected_output for val in vals)
+    else: #divide: first / (product of rest) == expected_output
+        product = 1
+        for val in vals:
+            product *= val
+        return any(val*val == expected_output*product for val in vals)
+
+class CageConstraint(Constraint):
+    '''A KenKen cage constraint represented by its operation and expected
+       output instead of a table of satisfying tuples, so it can be used
+       for big cages and large boards where the table cannot be built.
+
+       operation is coded as in the board format: 0: plus, 1: minus,
+       2: divide, 3: multiply. Minus and divide follow the semantics of
+       exist_satisfying_permutation: some cell, combined with all the
+       other cells of the cage, yields the expected output. Domain values
+       must be positive integers.
+
+       has_support reasons over the current domains directly: interval
+       bounds and reachable partial sums for plus, divisor filtering for
+       multiply, and the same two ideas for minus and divide with the
+       cell playing the first operand chosen in every possible way.
+
+       line_pairs optionally lists (i, j) scope index pairs of cells that
+       share a row or a column (see cage_line_pairs). Such cells must take
+       different values, which check enforces and has_support uses to
+       remove val from the domains of the cells in line with var.
+
+       has_support never rejects a supported value, but it can accept
+       unsupported ones, so a CageConstraint may prune less than GAC on
+       the table of the same cage. Without line_pairs it prunes exactly
+       as the full table would. With line_pairs the table (see
+       add_cageConstraints_to_model) drops every tuple repeating a value
+       within a line, while has_support only keeps the other cells in
+       line with var away from val: two other cells in line with each
+       other may still share a value.'''
+
+    table_based = False
+
+    def __init__(self, name, scope, operation, expected_output, line_pairs=[]):
+        Constraint.__init__(self, name, scope)
+        self.line_pairs = list(line_pairs)
+        if operation not in (0, 1, 2, 3):
+            print("invalid operation!\n")
+            exit(100)
+        self.operation = operation
+        self.expected_output = expected_output
+        if operation in (0, 1):
+            #plus and minus are only revised when the range of a cell
+            #shrinks (see propagation_engine.py)
+            self.wake_on = 'bounds'
+
+    def check(self, vals):
+        '''Return true iff the values (ordered as the scope) satisfy the cage'''
+        for i, j in self.line_pairs:
+            if vals[i] == vals[j]:
+                return False
+        return cage_satisfied(vals, self.operation, self.expected_output)
+
+    def has_support(self, var, val):
+        '''Test if var=val can be extended to a satisfying assignment
+           using values still in the current domains of the other cells'''
+        if not var.in_cur_domain(val):
+            return False
+        var_index = self.scope.index(var)
+        in_line = set()
+        for i, j in self.line_pairs:
+            if i == var_index:
+                in_line.add(j)
+            elif j == var_index:
+                in_line.add(i)
+        others = []
+        for i, v in enumerate(self.scope):
+            if i != var_index:
+                others.append([other_val for other_val in v.cur_domain()
+                               if not (i in in_line and other_val == val)])
+        if not all(others):
+            return False
+        target = self.expected_output
+
+        if self.operation == 0: #plus
+            remainder = target - val
+            #interval bounds first, then exact reachability
+            if not sum(min(d) for d in others) <= remainder <= sum(max(d) for d in others):
+                return False
+            return remainder in reachable_sums(others, remainder)
+
+        elif self.operation == 3: #multiply
+            if target % val != 0:
+                return False
+            return target // val in reachable_products(others, target // val)
+
+        elif self.operation == 1: #minus
+            #var is the first operand: val - (sum of others) == target
+            if val - target >= 0 and val - target in reachable_sums(others, val - target):
+                return True
+            #another cell is the first operand: first - val - (sum of rest) == target
+            for i in range(len(others)):
+                rest = others[:i] + others[i+1:]
+                sums = reachable_sums(rest, max(others[i]) - target - val)
+                for first in others[i]:
+                    if first - target - val in sums:
+                        return True
+            return False
+
+        else: #divide
+            #var is the first operand: val / (product of others) == target
+            if val % target == 0 and val // target in reachable_products(others, val // target):
+                return True
+            #another cell is the first operand: first / (val * product of rest) == target
+            for i in range(len(others)):
+                rest = others[:i] + others[i+1:]
+                for first in others[i]:
+                    if first % (target * val) == 0:
+                        if first // (target * val) in reachable_products(rest, first // (target * val)):
+                            return True
+            return False
+
+def cage_tuples(size, caged_variables, operation, expected_output, first_value=None):
+    """
+
+    :param size: size of the board
+    :param caged_variables: a list of (row_index, col_index) coordinates of the cells of the cage
+    :param operation: 0: plus; 1: minus; 2: divide; 3: multiply
+    :param expected_output: expected output of the cage constraint
+    :param first_value: if not None only the tuples giving this value to the first cell are computed
+    :return: the satisfying tuples of the cage; tuples repeating a value between two cells in the same row or
+             column are left out, as the grid constraints would reject them anyway
     """
-    caged_variables = cage[0]
-    operation = cage[1]
-    expected_output = cage[2]
-    size = len(board)
     var_dom = list(range(1,size+1))
+    domains = [var_dom] * len(caged_variables)
+    if first_value is not None:
+        domains = [[first_value]] + domains[1:]
 
-    #the scope of the constraint
-    scope = []
-    for (row_index, col_index) in caged_variables:
-        scope.append(board[row_index][col_index])
+    #pairs of cells in the same row or column can never hold the same value
+    line_pairs = cage_line_pairs(caged_variables)
 
-    #satisfying tuples for the constraint
     sat_tuples = []
-    for potential_sol in itertools.product(var_dom, repeat=len(caged_variables)):
+    for potential_sol in itertools.product(*domains):
+        if any(potential_sol[i] == potential_sol[j] for i, j in line_pairs):
+            continue
         real_output = potential_sol[0]
         counter = 1
         if operation == 0: #plus
@@ -208,7 +448,7 @@ def cage_constraint(board, cage, cage_index):
         elif operation == 1 or operation == 2: #minus or divide
             if exist_satisfying_permutation(potential_sol, operation, expected_output):
                 sat_tuples.append(potential_sol)
-                continue
+            continue
         elif operation == 3: #multiply
             while counter < len(potential_sol):
                 real_output *= potential_sol[counter]
@@ -218,6 +458,38 @@ def cage_constraint(board, cage, cage_index):
             exit(100)
         if real_output == expected_output:
             sat_tuples.append(potential_sol)
+    return sat_tuples
+
+def cage_constraint(board, cage, cage_index, native=False, sat_tuples=None):
+    """
+
+    :param board: board[0][0] is the variable representing value of upper most cell
+    :param cage: a list representing one cage constraint
+    :param cage_index: index of the cage constraint this function returns
+    :param native: if True return a CageConstraint instead of building the table of satisfying tuples; if None,
+                   a CageConstraint is returned when size ** (number of cells) exceeds CAGE_TABLE_LIMIT
+    :param sat_tuples: the satisfying tuples of the cage if already computed (see cage_tuples), None to compute them
+    :return: a cage constraint based on parameter "cage"
+    """
+    caged_variables = cage[0]
+    operation = cage[1]
+    expected_output = cage[2]
+    size = len(board)
+
+    #the scope of the constraint
+    scope = []
+    for (row_index, col_index) in caged_variables:
+        scope.append(board[row_index][col_index])
+
+    if native is None:
+        native = sat_tuples is None and size ** len(caged_variables) > CAGE_TABLE_LIMIT
+    if native:
+        return CageConstraint("cage_constraint_No.{}".format(cage_index), scope, operation, expected_output,
+                              cage_line_pairs(caged_variables))
+
+    #satisfying tuples for the constraint
+    if sat_tuples is None:
+        sat_tuples = cage_tuples(size, caged_variables, operation, expected_output)
 
     #create the constraint
     constraint = Constraint("cage_constraint_No.{}".format(cage_index), scope)
@@ -225,45 +497,90 @@ def cage_constraint(board, cage, cage_index):
 
     return constraint
 
-def add_cageConstraints_to_model(csp_without_cages, board, all_cages):
+def add_cageConstraints_to_model(csp_without_cages, board, all_cages, native_cages=False, processes=None):
     """
 
     :param csp_without_cages: kenken csp without cage constraints
     :param board: board[0][0] is the variable representing value of upper left cell
     :param all_cages: a list of lists, each element is a cage constraint
+    :param native_cages: if True use CageConstraint objects instead of tables; if None decide for every cage, see
+                         cage_constraint
+    :param processes: if greater than 1, the cage tables are computed in a pool of that many processes
     :return: a kenken csp with all the cage constraint added
     """
+    all_sat_tuples = [None] * len(all_cages)
+    if processes and processes > 1 and native_cages is not True:
+        #one task per cage and value of its first cell, so that a single big cage is split as well. Cages with an
+        #invalid operation are left to cage_constraint, which reports them in this process (exit in a worker would
+        #only break the pool)
+        size = len(board)
+        tabled = [i for i in range(len(all_cages)) if all_cages[i][1] in (0, 1, 2, 3)
+                  and (native_cages is False or size ** len(all_cages[i][0]) <= CAGE_TABLE_LIMIT)]
+        tasks = [(i, first_value) for i in tabled for first_value in range(1, size+1)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = pool.map(cage_tuples,
+                             [size] * len(tasks),
+                             [all_cages[i][0] for i, _ in tasks],
+                             [all_cages[i][1] for i, _ in tasks],
+                             [all_cages[i][2] for i, _ in tasks],
+                             [first_value for _, first_value in tasks])
+            for i in tabled:
+                all_sat_tuples[i] = []
+            for (i, _), part in zip(tasks, parts):
+                all_sat_tuples[i].extend(part)
+
     resulting_csp_after_adding_cage_constraints = csp_without_cages
     for i in range(len(all_cages)):
         cage = all_cages[i]
-        cur_cage_constraint = cage_constraint(board, cage, i)
+        cur_cage_constraint = cage_constraint(board, cage, i, native_cages, all_sat_tuples[i])
         resulting_csp_after_adding_cage_constraints.add_constraint(cur_cage_constraint)
     return resulting_csp_after_adding_cage_constraints
 
-def kenken_csp_model(kenken_grid):
+def decode_cages(kenken_grid):
     """
 
     :param kenken_grid: a list of list, first element being the size of the kenken grid board, rest are cage constraitns
-    :return: the kenken csp and the kenken_grid board containing all variables
+                        whose cells are either (row, col) pairs or row*10+col integers, see cell_coord
+    :return: the cage constraints info in the following form:
+             cages = [cage1: [[(var1_x, var1_y),(var2_x, var2_y),...], operation, result], cage2, cage3, ...]
     """
-
-    #first build the n-nary grid csp model without cage constraints
-    csp_without_cages, board = binary_ne_grid(kenken_grid)
-
-    #extract the cage constraints info and store into a list, in the following form:
-    #cages = [cage1: [[(var1_x, var1_y),(var2_x, var2_y),...], operation, result], cage2, cage3, ...]
     cages = []
     for i in range(1,len(kenken_grid)):
         cur_cage = kenken_grid[i]
         caged_variables = []
         for j in range(len(cur_cage)-2):
             caged_var = cur_cage[j]
-            caged_var_coord = (caged_var//10-1, caged_var%10-1)
+            caged_var_coord = cell_coord(caged_var)
             caged_variables.append(caged_var_coord)
         cages.append([caged_variables, cur_cage[-1], cur_cage[-2]])
+    return cages
+
+def kenken_csp_model(kenken_grid, native_cages=None, processes=None):
+    """
+
+    :param kenken_grid: a list of list, first element being the size of the kenken grid board, rest are cage constraitns
+    :param native_cages: if True cages are CageConstraint objects reasoning on arithmetic instead of tables, if
+                         False they are all tables; if None they are all tables on boards up to 9x9, and on larger
+                         boards only the cages too big for a table are native, which keeps the model tractable on
+                         boards up to 16x16
+    :param processes: if greater than 1, the cage tables are computed in a pool of that many processes
+    :return: the kenken csp and the kenken_grid board containing all variables
+    """
+
+    #first build the grid csp model without cage constraints: binary not-equal constraints, or on boards larger
+    #than 9x9 n-ary AllDiffConstraint objects, whose matching based filtering prunes far more than the pairs
+    if kenken_grid[0][0] > 9:
+        csp_without_cages, board = nary_ad_grid(kenken_grid, native=True)
+    else:
+        csp_without_cages, board = binary_ne_grid(kenken_grid)
+
+    cages = decode_cages(kenken_grid)
+    if native_cages is None and kenken_grid[0][0] <= 9:
+        #CageConstraint prunes less than a table (see its docstring), so boards the tables can handle keep them
+        native_cages = False
 
     #all all cage constraints
-    return add_cageConstraints_to_model(csp_without_cages, board, cages), board
+    return add_cageConstraints_to_model(csp_without_cages, board, cages, native_cages, processes), board
 
 
 
@@ -342,4 +659,4 @@ if __name__ == '__main__':
         print(item)
     pass
 
-    #last_update: 2019-07-20 19:26
\ No newline at end of file
+    #last_update: 2019-07-20 19:26
\ No newline at end of file
@@ -0,0 +1,240 @@
+'''
+This file contains a generator of random KenKen boards, used to load and
+scaling test the models in kenken_csp.py.
+
+A board is produced in three steps:
+    1. a random Latin square of the requested size (the solution),
+    2. a random partition of the grid into connected cages,
+    3. an operation for every cage, with the expected output computed
+       from the solution.
+
+Boards are emitted in the format kenken_csp_model expects, e.g.
+    [[3],[11,21,3,0],[12,22,2,1],[13,23,33,6,3],[31,32,5,0]]
+where every cage lists its cells (row and column, both counted from 1,
+encoded as row*10+col), then its expected output, then its operation
+(0: plus, 1: minus, 2: divide, 3: multiply). Boards larger than 9x9, which
+this encoding cannot express, list their cells as (row, col) pairs.
+
+Optionally the solver itself is used to check that the generated board
+has a unique solution.
+'''
+import random
+import io
+import contextlib
+
+from cspbase import *
+from propagators import prop_GAC
+from heuristics import ord_mrv
+from kenken_csp import kenken_csp_model
+
+def random_latin_square(size, rng, steps=None):
+    """
+
+    :param size: size of the square
+    :param rng: a random.Random object
+    :param steps: number of moves of the Jacobson-Matthews walk, size**3 by default
+    :return: a list of lists, a Latin square with values 1..size, drawn (approximately) uniformly at random
+    """
+    #the walk runs on the incidence cube: cube[r][c][s] is 1 iff cell (r, c)
+    #holds symbol s. A move may leave one entry at -1 (an improper cube),
+    #which the next moves fix. Only the moves made from a proper cube are
+    #counted as steps: the square returned is the steps-th proper cube the
+    #walk visits, and those are uniform once the walk has mixed (the first
+    #proper cube after a fixed number of moves is not). It starts from the
+    #cyclic square.
+    cube = [[[0] * size for _ in range(size)] for _ in range(size)]
+    for r in range(size):
+        for c in range(size):
+            cube[r][c][(r + c) % size] = 1
+    if steps is None:
+        steps = size ** 3
+    improper = None
+    n_steps = 0
+    while size > 1 and (n_steps < steps or improper is not None):
+        if improper is None:
+            r, c, s = rng.randrange(size), rng.randrange(size), rng.randrange(size)
+            if cube[r][c][s] != 0:
+                continue
+            r1 = [i for i in range(size) if cube[i][c][s] == 1][0]
+            c1 = [j for j in range(size) if cube[r][j][s] == 1][0]
+            s1 = cube[r][c].index(1)
+            n_steps += 1
+        else:
+            r, c, s = improper
+            r1 = rng.choice([i for i in range(size) if cube[i][c][s] == 1])
+            c1 = rng.choice([j for j in range(size) if cube[r][j][s] == 1])
+            s1 = rng.choice([k for k in range(size) if cube[r][c][k] == 1])
+        cube[r][c][s] += 1
+        cube[r][c1][s1] += 1
+        cube[r1][c][s1] += 1
+        cube[r1][c1][s] += 1
+        cube[r][c][s1] -= 1
+        cube[r][c1][s] -= 1
+        cube[r1][c][s] -= 1
+        cube[r1][c1][s1] -= 1
+        improper = (r1, c1, s1) if cube[r1][c1][s1] < 0 else None
+    return [[cube[r][c].index(1) + 1 for c in range(size)] for r in range(size)]
+
+def random_cages(size, rng, cage_sizes={1: 1, 2: 4, 3: 3, 4: 2}):
+    """
+
+    :param size: size of the board
+    :param rng: a random.Random object
+    :param cage_sizes: a dict cage_size --> weight; each cage draws its target size from these weights
+    :return: a list of cages, each a list of (row_index, col_index) cells, partitioning the board into connected
+             cages; a cage stays smaller than its target size when it cannot grow any further
+    """
+    sizes = list(cage_sizes.keys())
+    weights = list(cage_sizes.values())
+    free = set((i, j) for i in range(size) for j in range(size))
+    cages = []
+    for i in range(size):
+        for j in range(size):
+            if (i, j) not in free:
+                continue
+            target_size = rng.choices(sizes, weights)[0]
+            cage = [(i, j)]
+            free.remove((i, j))
+            while len(cage) < target_size:
+                frontier = []
+                for (row, col) in cage:
+                    for neighbour in ((row+1, col), (row-1, col), (row, col+1), (row, col-1)):
+                        if neighbour in free and neighbour not in frontier:
+                            frontier.append(neighbour)
+                if not frontier:
+                    break
+                cell = rng.choice(frontier)
+                cage.append(cell)
+                free.remove(cell)
+            cages.append(sorted(cage))
+    return cages
+
+def cage_operation(values, rng, operations={0: 3, 1: 2, 2: 2, 3: 3}):
+    """
+
+    :param values: the solution values of the cells of a cage
+    :param rng: a random.Random object
+    :param operations: a dict operation --> weight giving the operator mix
+    :return: (expected_output, operation) for the cage; operations that do not fit the values (minus giving a
+             non-positive output, divide giving a fraction) are replaced by another one of the mix
+    """
+    choices = [op for op in operations.keys() if operations[op] > 0]
+    weights = [operations[op] for op in choices]
+    while choices:
+        operation = rng.choices(choices, weights)[0]
+        first = max(values)
+        rest = list(values)
+        rest.remove(first)
+        product = 1
+        for val in rest:
+            product *= val
+        if operation == 0:
+            return sum(values), 0
+        elif operation == 3:
+            return product * first, 3
+        elif operation == 1 and len(values) > 1 and first - sum(rest) > 0:
+            return first - sum(rest), 1
+        elif operation == 2 and len(values) > 1 and first % product == 0:
+            return first // product, 2
+        index = choices.index(operation)
+        del choices[index]
+        del weights[index]
+    #none of the requested operations fit, so fall back to plus
+    return sum(values), 0
+
+class ExcludeAssignmentConstraint(Constraint):
+    '''Constraint ruling out one complete assignment of its scope. Used to
+       look for a second solution of a board without building a table.'''
+
+    table_based = False
+
+    def __init__(self, name, scope, excluded):
+        Constraint.__init__(self, name, scope)
+        self.excluded = tuple(excluded)
+
+    def check(self, vals):
+        return tuple(vals) != self.excluded
+
+    def has_support(self, var, val):
+        '''var=val is unsupported only if every other variable is left with
+           nothing but its excluded value and val is var's excluded value'''
+        for i, v in enumerate(self.scope):
+            if v is var:
+                if val != self.excluded[i]:
+                    return True
+            elif v.cur_domain_size() > 1 or not v.in_cur_domain(self.excluded[i]):
+                return True
+        return False
+
+def has_unique_solution(kenken_grid, solution):
+    """
+
+    :param kenken_grid: a board in the format kenken_csp_model expects
+    :param solution: a list of lists, a solution of "kenken_grid"
+    :return: True iff "solution" is the only solution of "kenken_grid"
+    """
+    csp, board = kenken_csp_model(kenken_grid, native_cages=True)
+    all_vars = [var for row in board for var in row]
+    excluded = [val for row in solution for val in row]
+    csp.add_constraint(ExcludeAssignmentConstraint("exclude_known_solution", all_vars, excluded))
+    solver = BT(csp)
+    with contextlib.redirect_stdout(io.StringIO()):
+        status = solver.bt_search(prop_GAC, ord_mrv)
+    solver.restore_all_variable_domains()
+    return not status
+
+def generate_board(size, rng=None, cage_sizes={1: 1, 2: 4, 3: 3, 4: 2}, operations={0: 3, 1: 2, 2: 2, 3: 3},
+                   unique=False, max_tries=100):
+    """
+
+    :param size: size of the board
+    :param rng: a random.Random object, a new unseeded one is used if None
+    :param cage_sizes: a dict cage_size --> weight, see random_cages
+    :param operations: a dict operation --> weight, see cage_operation
+    :param unique: if True keep generating until the board has a unique solution (at most max_tries boards)
+    :param max_tries: number of boards tried when "unique" is True
+    :return: (kenken_grid, solution), or None if no board with a unique solution was found
+    """
+    if size < 1:
+        print("ERROR: invalid board size", size)
+        return None
+    if rng is None:
+        rng = random.Random()
+
+    for _ in range(max_tries):
+        solution = random_latin_square(size, rng)
+        kenken_grid = [[size]]
+        for cage in random_cages(size, rng, cage_sizes):
+            values = [solution[row][col] for (row, col) in cage]
+            expected_output, operation = cage_operation(values, rng, operations)
+            if size <= 9:
+                cells = [(row+1)*10 + (col+1) for (row, col) in cage]
+            else:
+                cells = [(row+1, col+1) for (row, col) in cage]
+            kenken_grid.append(cells + [expected_output, operation])
+        if not unique or has_unique_solution(kenken_grid, solution):
+            return kenken_grid, solution
+    return None
+
+def generate_boards(count, size, seed=None, **kwargs):
+    """
+
+    :param count: number of boards to generate
+    :param size: size of the boards
+    :param seed: seed of the random generator, for reproducible board sets
+    :param kwargs: passed on to generate_board
+    :return: a list of (kenken_grid, solution) pairs
+    """
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        generated = generate_board(size, rng, **kwargs)
+        if generated is None:
+            break
+        boards.append(generated)
+    return boards
+
+
+if __name__ == '__main__':
+    for kenken_grid, solution in generate_boards(5, 4, seed=384, unique=True):
+        print(kenken_grid)
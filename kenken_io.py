@@ -0,0 +1,142 @@
+'''
+This file contains a text file format for KenKen boards of any size, with a
+streaming loader, so that large boards and long board sets can be read one
+board at a time.
+
+A file holds any number of boards, separated by blank lines. A board is a
+line with its size followed by one line per cage: the cells of the cage as
+row,col pairs (both counted from 1), then the expected output, then the
+operation (+, -, / and *, or 0 to 3 as in the list format). Lines starting
+with # are comments. For example
+
+    # a 3x3 board
+    3
+    1,1 2,1 3 +
+    1,2 2,2 2 -
+    1,3 2,3 3,3 6 *
+    3,1 3,2 5 +
+
+Boards are returned in the list format kenken_csp_model expects, with the
+cells as (row, col) pairs, e.g. [[3], [(1,1), (2,1), 3, 0], ...], which
+works for boards larger than 9x9 (see cell_coord in kenken_csp.py).
+'''
+from kenken_csp import cell_coord
+
+OPERATIONS = {'+': 0, '-': 1, '/': 2, '*': 3, '0': 0, '1': 1, '2': 2, '3': 3}
+OPERATION_SYMBOLS = '+-/*'
+
+def parse_cage(line):
+    """
+
+    :param line: a cage line, e.g. "1,1 2,1 3 +"
+    :return: the cage in the list format, [(row, col), ..., expected_output, operation], or None if the line is
+             malformed
+    """
+    tokens = line.split()
+    if len(tokens) < 3 or not tokens[-1] in OPERATIONS:
+        return None
+    cells = []
+    for token in tokens[:-2]:
+        coords = token.split(',')
+        if len(coords) != 2 or not coords[0].isdigit() or not coords[1].isdigit():
+            return None
+        cells.append((int(coords[0]), int(coords[1])))
+    if not tokens[-2].isdigit():
+        return None
+    return cells + [int(tokens[-2]), OPERATIONS[tokens[-1]]]
+
+def board_errors(kenken_grid):
+    """
+
+    :param kenken_grid: a board in the list format
+    :return: a list of messages, empty if every cell of the board lies on the grid and belongs to exactly one cage
+    """
+    size = kenken_grid[0][0]
+    errors = []
+    seen = set()
+    for cage in kenken_grid[1:]:
+        for cell in cage[:-2]:
+            row_index, col_index = cell_coord(cell)
+            if not (0 <= row_index < size and 0 <= col_index < size):
+                errors.append("cell {} is off the {}x{} grid".format(cell, size, size))
+            elif (row_index, col_index) in seen:
+                errors.append("cell {} is in more than one cage".format(cell))
+            seen.add((row_index, col_index))
+    if len(errors) == 0 and len(seen) != size * size:
+        errors.append("{} of the {} cells are in no cage".format(size * size - len(seen), size * size))
+    return errors
+
+def report_board_errors(kenken_grid):
+    '''Internal. Print the errors of a board read from a file, return
+       True if it has none'''
+    errors = board_errors(kenken_grid)
+    for error in errors:
+        print("ERROR: board of size {}: {}".format(kenken_grid[0][0], error))
+    return len(errors) == 0
+
+def read_boards(source):
+    """
+
+    :param source: a path or an open text file in the format described above
+    :return: a generator of the boards of the file, in the list format; the file is read one line at a time and
+             each board is yielded as soon as it is complete, so only one board is held in memory. Malformed
+             boards are reported and skipped.
+    """
+    own_file = isinstance(source, str)
+    f = open(source) if own_file else source
+    try:
+        kenken_grid = None
+        valid = True
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if line.startswith('#'):
+                continue
+            if not line:
+                if kenken_grid is not None:
+                    if valid and report_board_errors(kenken_grid):
+                        yield kenken_grid
+                    kenken_grid = None
+                continue
+            if kenken_grid is None:
+                if not line.isdigit():
+                    print("ERROR: line {}: expected the size of a board, got {}".format(line_number, line))
+                    kenken_grid = [[0]]
+                    valid = False
+                else:
+                    kenken_grid = [[int(line)]]
+                    valid = True
+                continue
+            cage = parse_cage(line)
+            if cage is None:
+                if valid:
+                    print("ERROR: line {}: malformed cage {}".format(line_number, line))
+                valid = False
+            else:
+                kenken_grid.append(cage)
+        if kenken_grid is not None and valid and report_board_errors(kenken_grid):
+            yield kenken_grid
+    finally:
+        if own_file:
+            f.close()
+
+def write_boards(out, boards):
+    """
+
+    :param out: a path or an open text file
+    :param boards: an iterable of boards in the list format (cells as pairs or row*10+col integers)
+    :return: None; the boards are written in the format described above, one at a time
+    """
+    own_file = isinstance(out, str)
+    f = open(out, 'w') if own_file else out
+    try:
+        for n, kenken_grid in enumerate(boards):
+            if n > 0:
+                f.write('\n')
+            f.write("{}\n".format(kenken_grid[0][0]))
+            for cage in kenken_grid[1:]:
+                cells = ["{},{}".format(row_index+1, col_index+1)
+                         for (row_index, col_index) in (cell_coord(cell) for cell in cage[:-2])]
+                f.write("{} {} {}\n".format(' '.join(cells), cage[-2], OPERATION_SYMBOLS[cage[-1]]))
+    finally:
+        if own_file:
+            f.close()
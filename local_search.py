@@ -0,0 +1,443 @@
+'''
+This file contains a min-conflicts local search solver, for instances too
+large for the systematic search of BT (large n-Queens, big KenKens), when a
+fast feasible answer is wanted rather than a proof.
+
+It works on the same CSP/Constraint objects as BT. Every variable is given
+a value (a greedy initial assignment), then, repeatedly, a variable in
+conflict is picked at random and moved to the value of its domain that
+violates the fewest constraints. Options:
+    walk_prob     probability of moving to a random value instead (random walk)
+    tabu_tenure   number of steps during which a variable may not return
+                  to a value it just left (unless that value has no conflict)
+    sample_size   evaluate only this many random values of a domain per
+                  move, for domains too large to scan
+    weighted      constraint weighting (breakout): when a variable has no
+                  improving move, the weights of its violated constraints
+                  are increased, which fills in the local minimum
+    swap_groups   groups of variables (e.g. the rows of a Latin square)
+                  whose values are kept all different: each group starts
+                  as a permutation and a move swaps the values of two
+                  variables of a group instead of changing one
+
+Conflict counts are maintained incrementally: moving a variable only
+updates the constraints over it. A constraint counts as violated when its
+scope is fully assigned and check fails. A constraint may instead provide
+its own incremental counts with the methods
+
+    ls_reset()                 forget all assignments (called when a
+                               search starts)
+    ls_conflicts(var, val)     conflicts var would have in the constraint
+                               if it took val, the others keeping theirs
+    ls_move(var, old, new)     record that var moved from old (None if it
+                               was unassigned) to new, and return a dict
+                               var --> change of its conflict count
+
+as QueensConstraint below does, so that n-Queens needs no tuple tables and
+no O(n^2) binary constraints. It may also provide
+
+    ls_candidates(var, rng, k)   up to k promising values for var
+
+which are evaluated before the random sample of the domain, so that moves
+on very large domains still find the few values without conflict.
+'''
+import random
+import time
+
+from cspbase import *
+
+class IndexedSet:
+    '''Internal. Set supporting O(1) add, remove and random choice'''
+
+    def __init__(self):
+        self.items = []
+        self.index = dict()
+
+    def add(self, item):
+        if not item in self.index:
+            self.index[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item):
+        if item in self.index:
+            i = self.index.pop(item)
+            last = self.items.pop()
+            if i < len(self.items):
+                self.items[i] = last
+                self.index[last] = i
+
+    def choice(self, rng):
+        return self.items[rng.randrange(len(self.items))]
+
+    def __len__(self):
+        return len(self.items)
+
+class MinConflicts:
+    '''use a class to encapsulate the state and statistics of the local
+       search, like BT. Make one of these objects passing the CSP, then
+       invoke its search routine.'''
+
+    def __init__(self, csp):
+        '''csp == CSP object specifying the CSP to be solved'''
+        self.csp = csp
+        self.nSteps = 0     #number of steps made after the initial assignment
+        self.runtime = 0
+
+    def print_stats(self):
+        print("Local search made {} steps in {} seconds".format(self.nSteps, self.runtime))
+
+    def violated(self, c):
+        '''Internal routine. Is the (default) constraint c violated by the
+           current assignment'''
+        vals = []
+        for v in c.scope:
+            if not v in self.assignment:
+                return False
+            vals.append(self.assignment[v])
+        return not c.check(vals)
+
+    def cost(self, var, val):
+        '''Internal routine. (Weighted) number of conflicts of var if it
+           took val'''
+        total = 0
+        old = self.assignment.get(var)
+        for c in self.csp.get_cons_with_var(var):
+            if hasattr(c, 'ls_conflicts'):
+                total += c.ls_conflicts(var, val)
+            else:
+                self.assignment[var] = val
+                if self.violated(c):
+                    total += self.weights[c]
+        if old is None:
+            self.assignment.pop(var, None)
+        else:
+            self.assignment[var] = old
+        return total
+
+    def candidates(self, var):
+        '''Internal routine. Generate the values of var to evaluate, in
+           random order (the values suggested by the constraints first when
+           sampling). A generator, as the caller usually stops early.'''
+        if self.sample_size is None or var.cur_domain_size() <= self.sample_size:
+            values = var.cur_domain()
+            self.rng.shuffle(values)
+            yield from values
+            return
+        seen = set()
+        for c in self.csp.get_cons_with_var(var):
+            if hasattr(c, 'ls_candidates'):
+                for val in c.ls_candidates(var, self.rng, self.sample_size):
+                    if not val in seen and var.in_cur_domain(val):
+                        seen.add(val)
+                        yield val
+        sampled = 0
+        while sampled < self.sample_size and len(seen) < var.cur_domain_size():
+            val = var.dom[self.rng.randrange(len(var.dom))]
+            if not val in seen and var.in_cur_domain(val):
+                seen.add(val)
+                sampled += 1
+                yield val
+
+    def best_value(self, var):
+        '''Internal routine. Return (val, cost), the non tabu value of var
+           with fewest conflicts (ties broken at random, a value without
+           conflict is taken as soon as it is found) and its cost'''
+        best_val = None
+        best_cost = None
+        for val in self.candidates(var):
+            if val == self.assignment.get(var):
+                continue
+            c = self.cost(var, val)
+            if c > 0 and self.tabu.get((var, val), -1) > self.nSteps:
+                continue
+            if best_cost is None or c < best_cost:
+                best_val, best_cost = val, c
+                if c == 0:
+                    break
+        return best_val, best_cost
+
+    def increase_weights(self, var):
+        '''Internal routine. Add one to the weight of every violated
+           (default) constraint over var'''
+        for c in self.csp.get_cons_with_var(var):
+            if c in self.weights and self.violated(c):
+                self.weights[c] += 1
+                for v in c.scope:
+                    self.conflicts[v] += 1
+
+    def move(self, var, val):
+        '''Internal routine. Set var to val and update the conflict counts'''
+        old = self.assignment.get(var)
+        changed = dict()
+        for c in self.csp.get_cons_with_var(var):
+            if hasattr(c, 'ls_move'):
+                for v, delta in c.ls_move(var, old, val).items():
+                    changed[v] = changed.get(v, 0) + delta
+            else:
+                was_violated = self.violated(c)
+                self.assignment[var] = val
+                now_violated = self.violated(c)
+                if old is None:
+                    del self.assignment[var]
+                else:
+                    self.assignment[var] = old
+                if was_violated != now_violated:
+                    delta = self.weights[c] if now_violated else -self.weights[c]
+                    for v in c.scope:
+                        changed[v] = changed.get(v, 0) + delta
+        self.assignment[var] = val
+        for v, delta in changed.items():
+            self.conflicts[v] += delta
+            if self.conflicts[v] > 0:
+                self.conflicted.add(v)
+            else:
+                self.conflicted.remove(v)
+
+    def init_group(self, group):
+        '''Internal routine. Give the variables of group all different
+           values, at random, in their current domains when possible'''
+        used = set()
+        for var in sorted(group, key=lambda v: v.cur_domain_size()):
+            values = [val for val in var.cur_domain() if not val in used]
+            if not values:
+                values = [val for val in var.domain() if not val in used]
+            val = self.rng.choice(values)
+            used.add(val)
+            self.move(var, val)
+
+    def best_swap(self, var, group, fixed):
+        '''Internal routine. Return (other, gain), the variable of group
+           whose value var should take in exchange for its own (None if no
+           swap is allowed) and the resulting decrease of their conflicts'''
+        a = self.assignment[var]
+        best_other = None
+        best_gain = None
+        others = list(group)
+        self.rng.shuffle(others)
+        for other in others:
+            if other is var or other in fixed:
+                continue
+            b = self.assignment[other]
+            if not var.in_cur_domain(b) or not other.in_cur_domain(a):
+                continue
+            if self.tabu.get((var, b), -1) > self.nSteps:
+                continue
+            #cost of both in the swapped assignment
+            self.assignment[other] = a
+            after = self.cost(var, b)
+            self.assignment[var] = b
+            after += self.cost(other, a)
+            self.assignment[var] = a
+            self.assignment[other] = b
+            gain = self.conflicts[var] + self.conflicts[other] - after
+            if best_gain is None or gain > best_gain:
+                best_other, best_gain = other, gain
+        return best_other, best_gain
+
+    def search(self, max_steps=100000, walk_prob=0.02, tabu_tenure=0, sample_size=None, weighted=False,
+               swap_groups=None, seed=None):
+        '''Run min-conflicts local search.
+
+           max_steps == maximum number of steps after the initial assignment
+           walk_prob == probability of a random walk move
+           tabu_tenure == number of moves a left value stays forbidden
+           sample_size == number of values evaluated per move, None for all
+           weighted == if True use constraint weighting
+           swap_groups == a list of lists of variables kept all different
+           seed == seed of the random generator
+
+           Returns True if a solution was found, in which case it is
+           assigned to the variables of the CSP (as after bt_search), False
+           if max_steps steps were made without finding one. Variables
+           already assigned before the search keep their value.'''
+        stime = time.process_time()
+        self.rng = random.Random(seed)
+        self.sample_size = sample_size
+        self.nSteps = 0
+        self.tabu = dict()
+        self.weights = dict((c, 1) for c in self.csp.get_all_cons() if not hasattr(c, 'ls_move'))
+        self.assignment = dict()
+        self.conflicts = dict((v, 0) for v in self.csp.get_all_vars())
+        self.conflicted = IndexedSet()
+        for c in self.csp.get_all_cons():
+            if hasattr(c, 'ls_reset'):
+                c.ls_reset()
+        if not self.csp.frozen:
+            self.csp.freeze()
+
+        #greedy initial assignment
+        fixed = set(v for v in self.csp.get_all_vars() if v.is_assigned())
+        for var in fixed:
+            self.move(var, var.get_assigned_value())
+        order = [v for v in self.csp.get_all_vars() if not v in fixed]
+        group_of = dict()
+        for group in swap_groups or []:
+            self.init_group([v for v in group if not v in fixed])
+            for var in group:
+                group_of[var] = group
+        self.rng.shuffle(order)
+        for var in order:
+            if var in group_of:
+                continue
+            if var.cur_domain_size() == 0:
+                print("CSP {} has a variable with an empty domain".format(self.csp.name))
+                return False
+            val, _ = self.best_value(var)
+            if val is None:
+                val = var.cur_domain()[0]
+            self.move(var, val)
+
+        while len(self.conflicted) > 0 and self.nSteps < max_steps:
+            var = self.conflicted.choice(self.rng)
+            if var in fixed:
+                #its conflicts can only be repaired by moving its neighbours
+                self.nSteps += 1
+                continue
+            old = self.assignment[var]
+            self.nSteps += 1
+            if var in group_of:
+                if self.rng.random() < walk_prob:
+                    other = self.rng.choice(group_of[var])
+                    gain = None
+                else:
+                    other, gain = self.best_swap(var, group_of[var], fixed)
+                if other is None or other is var or other in fixed:
+                    continue
+                if weighted and gain is not None and gain <= 0:
+                    self.increase_weights(var)
+                    continue
+                val = self.assignment[other]
+                if not var.in_cur_domain(val) or not other.in_cur_domain(old):
+                    continue
+                self.move(var, val)
+                self.move(other, old)
+            else:
+                if self.rng.random() < walk_prob:
+                    val = next(self.candidates(var))
+                else:
+                    val, cost = self.best_value(var)
+                    if weighted and (val is None or cost >= self.conflicts[var]):
+                        self.increase_weights(var)
+                        continue
+                if val is None or val == old:
+                    continue
+                self.move(var, val)
+            if tabu_tenure:
+                self.tabu[(var, old)] = self.nSteps + tabu_tenure
+
+        self.runtime = time.process_time() - stime
+        if len(self.conflicted) > 0:
+            print("CSP {} unsolved after {} steps".format(self.csp.name, self.nSteps))
+            return False
+        for var in order:
+            var.assign(self.assignment[var])
+        print("CSP {} solved by local search. CPU Time used = {}".format(self.csp.name, self.runtime))
+        return True
+
+class QueensConstraint(Constraint):
+    '''The n-Queens constraint over the whole board: scope[i] is the queen
+       of row i, its value the column (1 to n) it is placed in. It keeps the number
+       of queens on every column and diagonal, so it needs no tuple table
+       and supports the incremental ls_conflicts/ls_move interface of
+       MinConflicts in O(1) per affected queen.
+
+       has_support only looks at the assigned queens (a forward checking
+       level of reasoning), which is enough for BT with prop_FC.'''
+
+    table_based = False
+
+    def __init__(self, name, scope):
+        Constraint.__init__(self, name, scope)
+        self.row = dict((var, i) for i, var in enumerate(self.scope))
+        self.ls_reset()
+
+    def ls_reset(self):
+        #line --> set of rows of the queens on it, for the incremental counts
+        self.cols = dict()
+        self.diags = dict()
+        self.anti_diags = dict()
+        #columns without any queen, the candidates of ls_candidates
+        self.free_cols = IndexedSet()
+        for val in range(1, len(self.scope)+1):
+            self.free_cols.add(val)
+
+    def check(self, vals):
+        n = len(vals)
+        return (len(set(vals)) == n and len(set(i + val for i, val in enumerate(vals))) == n
+                and len(set(i - val for i, val in enumerate(vals))) == n)
+
+    def has_support(self, var, val):
+        i = self.row[var]
+        for j, other in enumerate(self.scope):
+            if other is not var and other.is_assigned():
+                other_val = other.get_assigned_value()
+                if other_val == val or abs(other_val - val) == abs(i - j):
+                    return False
+        return True
+
+    def lines(self, i, val):
+        '''Internal routine. The (line table, key) pairs of square (i, val)'''
+        return ((self.cols, val), (self.diags, i + val), (self.anti_diags, i - val))
+
+    def ls_conflicts(self, var, val):
+        i = self.row[var]
+        total = 0
+        for table, key in self.lines(i, val):
+            queens = table.get(key)
+            if queens:
+                total += len(queens) - (1 if i in queens else 0)
+        return total
+
+    def ls_candidates(self, var, rng, k):
+        if len(self.free_cols) <= k:
+            yield from list(self.free_cols.items)
+            return
+        for _ in range(k):
+            yield self.free_cols.choice(rng)
+
+    def ls_move(self, var, old, new):
+        i = self.row[var]
+        changed = dict()
+        if old is not None:
+            for table, key in self.lines(i, old):
+                table[key].discard(i)
+                for j in table[key]:
+                    changed[self.scope[j]] = changed.get(self.scope[j], 0) - 1
+                changed[var] = changed.get(var, 0) - len(table[key])
+            if not self.cols[old]:
+                self.free_cols.add(old)
+        self.free_cols.remove(new)
+        for table, key in self.lines(i, new):
+            if not key in table:
+                table[key] = set()
+            for j in table[key]:
+                changed[self.scope[j]] = changed.get(self.scope[j], 0) + 1
+            changed[var] = changed.get(var, 0) + len(table[key])
+            table[key].add(i)
+        return changed
+
+def nQueens_model(n):
+    '''Return an n-queens CSP with a single QueensConstraint and integer
+       interval variables: O(n) memory, no tuple tables'''
+    vars = [IntRangeVariable('Q{}'.format(i+1), 1, n) for i in range(n)]
+    csp = CSP("{}-Queens".format(n), vars)
+    csp.add_constraint(QueensConstraint("Queens", vars))
+    return csp
+
+
+if __name__ == '__main__':
+    from kenken_csp import kenken_csp_model
+    for n in (8, 1000, 100000):
+        csp = nQueens_model(n)
+        solver = MinConflicts(csp)
+        solver.search(walk_prob=0.0, sample_size=50, seed=384)
+        solver.print_stats()
+
+    #KenKen: keep every row a permutation, swap moves repair columns and cages
+    csp, board = kenken_csp_model([[6],[11,21,11,0],[12,13,2,2],[14,24,20,3],[15,16,26,36,6,3],[22,23,3,1],
+                                   [25,35,3,2],[31,32,41,42,240,3],[33,34,6,3],[43,53,6,3],[44,54,55,7,0],
+                                   [45,46,30,3],[51,52,6,3],[56,66,9,0],[61,62,63,8,0],[64,65,2,2]],
+                                  native_cages=True)
+    solver = MinConflicts(csp)
+    solver.search(walk_prob=0.01, tabu_tenure=2, weighted=True, swap_groups=board, seed=384)
+    solver.print_stats()
@@ -0,0 +1,230 @@
+'''
+This file contains a multi-valued decision diagram (MDD) representation of
+constraints, for large table constraints (big cages, the permutation
+tables of nary_ad_grid) whose satisfying tuples are highly redundant.
+
+An MDD over k ordered positions is a layered graph: layer 0 holds a single
+root, layer k a single terminal, and every edge from layer i to layer i+1
+is labelled with a value of position i. A tuple satisfies the constraint
+iff its values spell a path from the root to the terminal. The MDD is kept
+reduced (nodes with the same outgoing edges are merged), so its size can be
+exponentially smaller than the number of tuples.
+
+MDDs are built either
+    mdd_from_tuples        from any iterable of tuples (e.g. a generator)
+    mdd_from_transitions   layer by layer from a state transition function,
+                           without ever enumerating the tuples
+
+MDDConstraint is a Constraint represented by an MDD. Its supported_values
+method finds, in one forward and one backward pass over the MDD, every
+value of the scope that still lies on a root to terminal path of current
+domain values; GAC_enforce in propagators.py uses it to revise the whole
+scope at a cost linear in the MDD size, not in the number of tuples.
+'''
+from cspbase import *
+
+class MDD:
+    '''A reduced MDD. layers[i] is the list of nodes of layer i, each node a
+       dict value --> index of the child node in layers[i+1]. layers[0]
+       holds only the root, layers[arity] only the terminal (an empty
+       dict). An MDD without any path has no root: layers[0] is empty.'''
+
+    def __init__(self, arity, layers):
+        self.arity = arity
+        self.layers = layers
+
+    def contains(self, vals):
+        '''return True iff vals spell a path from the root to the terminal'''
+        if not self.layers[0]:
+            return False
+        node = 0
+        for i, val in enumerate(vals):
+            edges = self.layers[i][node]
+            if not val in edges:
+                return False
+            node = edges[val]
+        return True
+
+    def n_nodes(self):
+        return sum(len(layer) for layer in self.layers)
+
+    def n_edges(self):
+        return sum(len(node) for layer in self.layers for node in layer)
+
+    def tuples(self):
+        '''generate every tuple accepted by the MDD'''
+        def paths(i, node, prefix):
+            if i == self.arity:
+                yield tuple(prefix)
+                return
+            for val, child in self.layers[i][node].items():
+                prefix.append(val)
+                yield from paths(i+1, child, prefix)
+                prefix.pop()
+        if self.layers[0]:
+            yield from paths(0, 0, [])
+
+def reduce_layers(arity, layers):
+    """
+
+    :param arity: number of positions
+    :param layers: layers[i] is a list of nodes, each a dict value --> index of a child in layers[i+1]; the
+                   last layer (index arity) must contain exactly the terminal nodes, all of them accepting
+    :return: the reduced MDD: nodes that cannot reach the terminal are dropped and nodes with identical edges
+             are merged, bottom up; unreachable nodes are dropped as only the nodes below the root (node 0 of
+             layer 0) are kept
+    """
+    #canonical[i][node] = index of the node in the reduced layer i, None if dead
+    reduced = [None] * (arity + 1)
+    reduced[arity] = [dict()]
+    canonical = [0] * len(layers[arity])
+    for i in range(arity-1, -1, -1):
+        signatures = dict()
+        new_layer = []
+        new_canonical = []
+        for node in layers[i]:
+            edges = dict()
+            for val, child in node.items():
+                if canonical[child] is not None:
+                    edges[val] = canonical[child]
+            if not edges:
+                new_canonical.append(None)
+                continue
+            signature = frozenset(edges.items())
+            if not signature in signatures:
+                signatures[signature] = len(new_layer)
+                new_layer.append(edges)
+            new_canonical.append(signatures[signature])
+        reduced[i] = new_layer
+        canonical = new_canonical
+
+    #keep only the nodes reachable from the root, renumbered from 0
+    if not layers[0] or canonical[0] is None:
+        return MDD(arity, [[] for _ in range(arity)] + [[dict()]])
+    keep = [canonical[0]]
+    for i in range(arity):
+        index = dict((node, j) for j, node in enumerate(keep))
+        children = []
+        for node in keep:
+            for child in reduced[i][node].values():
+                if not child in children:
+                    children.append(child)
+        child_index = dict((child, j) for j, child in enumerate(children))
+        reduced[i] = [dict((val, child_index[child]) for val, child in reduced[i][node].items()) for node in keep]
+        keep = children
+    return MDD(arity, reduced)
+
+def mdd_from_tuples(arity, tuples):
+    """
+
+    :param arity: length of the tuples
+    :param tuples: an iterable (list, generator...) of tuples of length "arity"
+    :return: the reduced MDD accepting exactly "tuples"
+    """
+    #build a trie, then reduce it
+    layers = [[dict()] for _ in range(arity)] + [[dict()]]
+    for t in tuples:
+        node = 0
+        for i in range(arity):
+            val = t[i]
+            edges = layers[i][node]
+            if not val in edges:
+                if i == arity - 1:
+                    edges[val] = 0
+                else:
+                    edges[val] = len(layers[i+1])
+                    layers[i+1].append(dict())
+            node = edges[val]
+    if not layers[0][0]:
+        layers[0] = []
+    return reduce_layers(arity, layers)
+
+def mdd_from_transitions(domains, initial_state, transition, accept=None):
+    """
+
+    :param domains: a list of domains, one for each position
+    :param initial_state: state before any value is chosen; states must be hashable
+    :param transition: transition(i, state, val) returns the state after choosing val for position i, or None
+                       if no tuple extends this choice
+    :param accept: accept(state) tells whether a state after the last position is accepting; all are if None
+    :return: the reduced MDD whose paths are the accepted value sequences; paths reaching the same state at the
+             same layer share their node, so the tuples are never enumerated
+    """
+    arity = len(domains)
+    layers = []
+    states = {initial_state: 0}
+    for i in range(arity):
+        layer = [dict() for _ in range(len(states))]
+        next_states = dict()
+        for state, node in states.items():
+            for val in domains[i]:
+                next_state = transition(i, state, val)
+                if next_state is None:
+                    continue
+                if i == arity - 1 and accept is not None and not accept(next_state):
+                    continue
+                if i == arity - 1:
+                    #a single terminal
+                    next_state = True
+                if not next_state in next_states:
+                    next_states[next_state] = len(next_states)
+                layer[node][val] = next_states[next_state]
+        layers.append(layer)
+        states = next_states
+    layers.append([dict() for _ in range(max(1, len(states)))])
+    return reduce_layers(arity, layers)
+
+class MDDConstraint(Constraint):
+    '''Constraint whose satisfying tuples are the paths of an MDD over its
+       scope (in scope order). No table is stored.'''
+
+    table_based = False
+
+    def __init__(self, name, scope, mdd):
+        Constraint.__init__(self, name, scope)
+        if mdd.arity != len(self.scope):
+            print("ERROR: MDD of arity", mdd.arity, "for constraint", name, "over", len(self.scope), "variables")
+        self.mdd = mdd
+
+    def check(self, vals):
+        return self.mdd.contains(vals)
+
+    def supported_values(self):
+        '''return a dict var --> set of values of var lying on some path of
+           current domain values from the root to the terminal. One forward
+           pass marks the nodes reachable from the root, one backward pass
+           the reachable nodes that still reach the terminal.'''
+        layers = self.mdd.layers
+        arity = self.mdd.arity
+        doms = [set(var.cur_domain()) for var in self.scope]
+        supported = dict((var, set()) for var in self.scope)
+        if not layers[0]:
+            return supported
+
+        reached = [set() for _ in range(arity + 1)]
+        reached[0].add(0)
+        for i in range(arity):
+            for node in reached[i]:
+                for val, child in layers[i][node].items():
+                    if val in doms[i]:
+                        reached[i+1].add(child)
+
+        alive = reached[arity]
+        for i in range(arity-1, -1, -1):
+            var = self.scope[i]
+            alive_here = set()
+            for node in reached[i]:
+                for val, child in layers[i][node].items():
+                    if val in doms[i] and child in alive:
+                        alive_here.add(node)
+                        supported[var].add(val)
+            alive = alive_here
+        return supported
+
+    def has_support(self, var, val):
+        '''Test if var=val lies on a path of current domain values (one
+           pass over the MDD; propagators revising the whole scope should
+           call supported_values once instead)'''
+        if not var.in_cur_domain(val):
+            return False
+        return val in self.supported_values()[var]
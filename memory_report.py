@@ -0,0 +1,168 @@
+'''
+This file contains memory footprint reporting for built CSP models, used
+to find which constraint tables blow a memory limit before choosing a
+model (binary_ne_grid, nary_ad_grid, kenken_csp_model) for a board size.
+
+Two measures are offered:
+    csp_memory_report    object-size accounting of a built CSP, broken
+                         down by constraint (sat_tuples versus sup_tuples,
+                         and the model of constraints without a table) and
+                         by variable (domain storage).
+    model_build_memory   tracemalloc measurement of the current and peak
+                         memory allocated while building a model.
+
+Constraints that are not given by a table keep their relation in other
+attributes: the node tables of an MDDConstraint, the line_pairs of a
+CageConstraint, the domain snapshot of a SharedTableConstraint. Those are
+reported as the constraint's model_bytes, so that table and table-free
+models can be compared.
+
+Object sizes are computed with sys.getsizeof, following containers
+(dicts, lists, tuples, sets) and the attributes of other objects (e.g. an
+MDD), and counting every object once: a tuple
+stored both as a key of sat_tuples and in a sup_tuples list is charged
+to sat_tuples only, and tuples shared between constraints (nary_ad_grid
+gives all its rows and columns the same permutation tuples) are charged
+to the first constraint holding them. Variable and Constraint objects met inside
+containers (e.g. the (var, val) keys of sup_tuples) are not followed.
+'''
+import sys
+import tracemalloc
+
+from cspbase import *
+
+def deep_sizeof(obj, seen):
+    """
+
+    :param obj: the object to measure
+    :param seen: a set of ids of objects already counted, updated in place
+    :return: size in bytes of "obj" and of the containers and values it holds, not counting objects in "seen"
+    """
+    if id(obj) in seen or isinstance(obj, (Variable, Constraint)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += deep_sizeof(obj.__dict__, seen)
+    return size
+
+#attributes of every Constraint, measured separately or not at all by constraint_footprint
+TABLE_ATTRIBUTES = ('name', 'scope', 'sat_tuples', 'sup_tuples', 'sup_tuples_built', 'projections')
+
+def constraint_footprint(constraint, seen, build_sup=False):
+    """
+
+    :param constraint: the constraint to measure
+    :param seen: a set of ids of objects already counted, shared across the whole report
+    :param build_sup: if True build the lazy sup_tuples index first, to see what GAC would cost
+    :return: a dict with the constraint's name, class, arity, number of tuples and bytes used by its
+             sat_tuples, sup_tuples and forward checking projections, and by the rest of its attributes
+             (model_bytes: the MDD, cage description, ... of constraints without a table)
+    """
+    model = dict((key, value) for key, value in vars(constraint).items() if not key in TABLE_ATTRIBUTES)
+    if build_sup and constraint.sat_tuples:
+        constraint.get_sup_tuples()
+    return {'name': constraint.name,
+            'type': type(constraint).__name__,
+            'arity': len(constraint.scope),
+            #tables kept in a TableStore file (see table_store.py) take no heap memory
+            'n_tuples': getattr(constraint, 'n_tuples', len(constraint.sat_tuples)),
+            'sat_bytes': deep_sizeof(constraint.sat_tuples, seen),
+            'sup_bytes': deep_sizeof(constraint.sup_tuples, seen),
+            'proj_bytes': deep_sizeof(constraint.projections, seen),
+            'model_bytes': deep_sizeof(model, seen) - sys.getsizeof(model),
+            'sup_built': constraint.sup_tuples_built}
+
+def variable_footprint(var, seen):
+    """
+
+    :param var: the variable to measure
+    :param seen: a set of ids of objects already counted, shared across the whole report
+    :return: a dict with the variable's name, domain size and bytes used by its domain storage
+             (dom, dom_index and curdom)
+    """
+    return {'name': var.name,
+            'domain_size': var.domain_size(),
+            'domain_bytes': deep_sizeof(var.dom, seen) + deep_sizeof(var.dom_index, seen)
+                            + deep_sizeof(var.curdom, seen)}
+
+def csp_memory_report(csp, build_sup=False):
+    """
+
+    :param csp: a built CSP
+    :param build_sup: if True build every lazy sup_tuples index before measuring
+    :return: a dict with per constraint footprints ('constraints'), per variable footprints ('variables') and
+             the totals 'sat_bytes', 'sup_bytes', 'proj_bytes', 'model_bytes' and 'domain_bytes'
+    """
+    seen = set()
+    cons = [constraint_footprint(c, seen, build_sup) for c in csp.get_all_cons()]
+    vars = [variable_footprint(v, seen) for v in csp.get_all_vars()]
+    return {'name': csp.name,
+            'constraints': cons,
+            'variables': vars,
+            'sat_bytes': sum(c['sat_bytes'] for c in cons),
+            'sup_bytes': sum(c['sup_bytes'] for c in cons),
+            'proj_bytes': sum(c['proj_bytes'] for c in cons),
+            'model_bytes': sum(c['model_bytes'] for c in cons),
+            'domain_bytes': sum(v['domain_bytes'] for v in vars)}
+
+def print_memory_report(report, top=10):
+    """
+
+    :param report: a report returned by csp_memory_report
+    :param top: number of largest constraints to list
+    """
+    print("CSP {}: {} constraints, {} variables".format(report['name'], len(report['constraints']),
+                                                         len(report['variables'])))
+    print("   sat_tuples = {} bytes, sup_tuples = {} bytes, projections = {} bytes, models = {} bytes, "
+          "domains = {} bytes".format(report['sat_bytes'], report['sup_bytes'], report['proj_bytes'],
+                                      report['model_bytes'], report['domain_bytes']))
+    largest = sorted(report['constraints'], key=lambda c: c['sat_bytes'] + c['sup_bytes'] + c['model_bytes'],
+                     reverse=True)
+    for c in largest[:top]:
+        print("   {} ({}, arity {}): {} tuples, sat_tuples = {} bytes, sup_tuples = {} bytes{}, model = {} bytes".format(
+            c['name'], c['type'], c['arity'], c['n_tuples'], c['sat_bytes'], c['sup_bytes'],
+            "" if c['sup_built'] else " (not built)", c['model_bytes']))
+
+def model_build_memory(model, kenken_grid, *args, **kwargs):
+    """
+
+    :param model: a model building function, e.g. binary_ne_grid, nary_ad_grid or kenken_csp_model
+    :param kenken_grid: the board passed to "model"
+    :param args: further arguments passed to "model"
+    :param kwargs: further keyword arguments passed to "model"
+    :return: (csp, board, current_bytes, peak_bytes) where the byte counts are the memory allocated by the
+             build that is still held afterwards and at its peak, as traced by tracemalloc
+    """
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    csp, board = model(kenken_grid, *args, **kwargs)
+    current, peak = tracemalloc.get_traced_memory()
+    if not already_tracing:
+        tracemalloc.stop()
+    return csp, board, current - start, peak - start
+
+
+if __name__ == '__main__':
+    from kenken_csp import binary_ne_grid, nary_ad_grid, kenken_csp_model
+
+    boards = [[[3],[11,21,3,0],[12,22,2,1],[13,23,33,6,3],[31,32,5,0]],
+              [[6],[11,21,11,0],[12,13,2,2],[14,24,20,3],[15,16,26,36,6,3],[22,23,3,1],[25,35,3,2],
+               [31,32,41,42,240,3],[33,34,6,3],[43,53,6,3],[44,54,55,7,0],[45,46,30,3],[51,52,6,3],[56,66,9,0],
+               [61,62,63,8,0],[64,65,2,2]]]
+    for b in boards:
+        for model in (binary_ne_grid, nary_ad_grid, kenken_csp_model):
+            csp, board, current, peak = model_build_memory(model, b)
+            print("{} on a {}x{} board: {} bytes held, {} bytes peak during build".format(
+                model.__name__, b[0][0], b[0][0], current, peak))
+            print_memory_report(csp_memory_report(csp, build_sup=True), top=3)
+            print("")
@@ -0,0 +1,141 @@
+'''
+This file contains an event driven propagation engine, a propagator for
+bt_search in which constraints are woken by the domain changes of their
+variables instead of being rescanned from get_cons_with_var:
+
+    solver.bt_search(PropagationEngine(), ord_mrv)
+
+(one engine per CSP; the root call subscribes the constraints, and
+BT.finish_search unsubscribes them once the search is over).
+
+Variables report their changes to their listener (see Variable.prune_value
+and Variable.assign). A change is one of three events, from the weakest to
+the strongest:
+
+    'remove'    a value was removed from the current domain
+    'bounds'    the smallest or the largest current value was removed
+    'fix'       the variable is down to one value (assigned, or pruned to
+                a single value)
+
+A stronger event implies the weaker ones. Every constraint subscribes to
+the weakest event that can make it prune (Constraint.wake_on): a table or
+cage constraint to 'remove', a NotEqualConstraint to 'fix' only, since it
+prunes nothing before the other variable is fixed. A plus or minus
+CageConstraint subscribes to 'bounds': it is then revised when the range of
+a cell shrinks, not for every hole punched in it, and may prune less than
+prop_GAC would (the search stays correct, check is exact). An event wakes the
+constraints of its variable subscribed to it or to a weaker event; a woken
+constraint is revised as by prop_GAC (see GAC_revise), and its prunings
+raise events in turn, until nothing is woken any more. Prunings therefore
+cascade: a variable pruned to a single value fixes it, and its neighbours
+lose that value, which prop_FC does not do.
+
+Events raised outside a call of the engine (e.g. the tentative prunings of
+val_lcv) are ignored.
+'''
+import collections
+
+from propagators import GAC_revise
+
+#the events a change of each kind raises, weakest first
+RAISED_EVENTS = {'remove': ('remove',), 'bounds': ('remove', 'bounds'), 'fix': ('remove', 'bounds', 'fix')}
+
+class PropagationEngine:
+    '''Propagator waking only the constraints subscribed to the domain
+       events raised by the search and by propagation itself'''
+
+    def __init__(self):
+        self.csp = None
+        self.subscribers = dict()   #var --> dict event --> constraints subscribed to it
+        self.watch_bounds = set()   #vars some constraint over which waits for 'bounds'
+        self.queue = collections.deque()
+        self.queued = set()
+        self.current = None         #the constraint being revised
+        self.active = False         #events are only handled during a call
+        self.n_events = 0           #for statistics
+        self.n_revisions = 0
+
+    def attach(self, csp):
+        '''Subscribe the constraints of csp to the events of their
+           variables, and become the listener of its variables'''
+        if not csp.frozen:
+            csp.freeze()
+        self.csp = csp
+        self.subscribers = dict()
+        self.watch_bounds = set()
+        for var in csp.get_all_vars():
+            subscribed = {'remove': [], 'bounds': [], 'fix': []}
+            for constraint in csp.get_cons_with_var(var):
+                subscribed[constraint.wake_on].append(constraint)
+            self.subscribers[var] = subscribed
+            if subscribed['bounds']:
+                self.watch_bounds.add(var)
+            var.listener = self
+
+    def detach(self):
+        '''Stop listening to the variables of the CSP'''
+        if self.csp is not None:
+            for var in self.csp.get_all_vars():
+                if var.listener is self:
+                    var.listener = None
+        self.csp = None
+        self.subscribers = dict()
+        self.watch_bounds = set()
+
+    def on_prune(self, var, value):
+        '''Called by var.prune_value once value is removed'''
+        if not self.active:
+            return
+        if var.cur_domain_size() <= 1:
+            self.wake(var, 'fix')
+        elif var in self.watch_bounds:
+            remaining = var.cur_domain()
+            if value < min(remaining) or value > max(remaining):
+                self.wake(var, 'bounds')
+            else:
+                self.wake(var, 'remove')
+        else:
+            self.wake(var, 'remove')
+
+    def on_assign(self, var):
+        '''Called by var.assign'''
+        if self.active:
+            self.wake(var, 'fix')
+
+    def wake(self, var, event):
+        '''Internal. Queue the constraints over var woken by event'''
+        self.n_events += 1
+        subscribed = self.subscribers[var]
+        for raised in RAISED_EVENTS[event]:
+            for constraint in subscribed[raised]:
+                if constraint is not self.current and not constraint in self.queued:
+                    self.queued.add(constraint)
+                    self.queue.append(constraint)
+
+    def __call__(self, csp, newVar=None):
+        if not newVar or csp is not self.csp or not csp.frozen:
+            self.attach(csp)
+        self.queue.clear()
+        self.queued.clear()
+        if not newVar:
+            for constraint in csp.get_all_cons():
+                self.queued.add(constraint)
+                self.queue.append(constraint)
+        else:
+            #newVar was assigned before the call, while events were ignored
+            self.wake(newVar, 'fix')
+
+        pruned = []
+        self.active = True
+        try:
+            while self.queue:
+                constraint = self.queue.popleft()
+                self.queued.discard(constraint)
+                self.current = constraint
+                self.n_revisions += 1
+                if GAC_revise(constraint, pruned) is None:
+                    return (False, pruned)
+        finally:
+            self.active = False
+            self.current = None
+        return (True, pruned)
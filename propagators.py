@@ -59,6 +59,12 @@
          for gac we initialize the GAC queue with all constraints containing V.
    '''
 
+import time
+import itertools
+import collections
+
+from cspbase import NotEqualConstraint
+
 def prop_BT(csp, newVar=None):
     '''Do plain backtracking propagation. That is, do no 
     propagation at all. Just check fully instantiated constraints'''
@@ -87,8 +93,27 @@ def FC_check(constraint, last_var):
     last_var_after_prune = last_var
     pruned_values = []
 
+    if isinstance(constraint, NotEqualConstraint):
+        #fast path: only the value of the other (assigned) variable can be ruled out
+        other_value = constraint.other_var(last_var).get_assigned_value()
+        if last_var.in_cur_domain(other_value):
+            last_var.prune_value(other_value)
+            pruned_values.append((last_var, other_value))
+        return (last_var.cur_domain_size() == 0, last_var, pruned_values)
+
     scope = constraint.get_scope()
     last_var_index = scope.index(last_var)
+
+    if constraint.table_based:
+        #one lookup in the projection index gives all allowed values of last_var
+        key = tuple([var.get_assigned_value() for var in scope if var is not last_var])
+        allowed_values = constraint.get_projection(last_var_index).get(key, ())
+        for last_var_value in last_var.cur_domain():
+            if not last_var_value in allowed_values:
+                last_var.prune_value(last_var_value)
+                pruned_values.append((last_var, last_var_value))
+        return (last_var.cur_domain_size() == 0, last_var, pruned_values)
+
     assignment = []
     for i in range(len(scope)):
         if i == last_var_index:
@@ -115,14 +140,14 @@ def prop_FC(csp, newVar=None):
     if not newVar: #need to check all constraints that have one unassigned variable
         for con in csp.get_all_cons():
             if len(con.get_scope()) == 1:
-                DWO, con.get_scope()[0], pruned_values_for_cur_con = FC_check(con, con.get_scope()[0])
+                DWO, _, pruned_values_for_cur_con = FC_check(con, con.get_scope()[0])
                 pruned_values.extend(pruned_values_for_cur_con)
                 if DWO:
                     return (False, pruned_values)
     else: #only check those constraints with newVar in scope and one unassigned variable
         for con in csp.get_cons_with_var(newVar):
             if con.get_n_unasgn() == 1:
-                DWO, con.get_unasgn_vars()[0], pruned_values_for_cur_con = FC_check(con, con.get_unasgn_vars()[0])
+                DWO, _, pruned_values_for_cur_con = FC_check(con, con.get_unasgn_vars()[0])
                 pruned_values.extend(pruned_values_for_cur_con)
                 if DWO:
                     return (False, pruned_values)
@@ -134,17 +159,65 @@ This class obeys FIFO, but does not allow duplicate objects
 '''
 class UniqueQueue():
     def __init__(self):
+        #the deque gives the FIFO order, so that propagation (and hence
+        #search) is the same from one run to the next; the set rejects
+        #duplicates
+        self.items = collections.deque()
         self.all_items = set()
 
     def put(self, item):
-        self.all_items.add(item)
+        if not item in self.all_items:
+            self.all_items.add(item)
+            self.items.append(item)
 
     def get(self):
-        return self.all_items.pop()
+        item = self.items.popleft()
+        self.all_items.discard(item)
+        return item
 
     def empty(self):
         return len(self.all_items) == 0
 
+def GAC_unsupported_candidates(constraint, var):
+    """
+
+    :param constraint: the constraint being revised
+    :param var: a variable in the scope of "constraint"
+    :return: the values of var's current domain that may have lost their support in "constraint"
+    """
+    if isinstance(constraint, NotEqualConstraint):
+        #fast path: only the sole remaining value of the other variable can be unsupported
+        other = constraint.other_var(var)
+        if other.cur_domain_size() == 1 and var.in_cur_domain(other.cur_domain()[0]):
+            return other.cur_domain()
+        return []
+    return var.cur_domain()
+
+def GAC_revise(constraint, pruned):
+    """
+
+    :param constraint: the constraint whose scope is revised
+    :param pruned: a list the (var, pruned_value) pairs are appended to
+    :return: the list of variables of the scope that lost a value, or None if one of them lost all its values (DWO)
+    """
+    if hasattr(constraint, 'supported_values'):
+        #constraints such as MDDConstraint and AllDiffConstraint revise their whole scope at once
+        supported = constraint.supported_values()
+        has_support = lambda var, value: value in supported[var]
+    else:
+        has_support = constraint.has_support
+    changed = []
+    for var in constraint.get_scope():
+        for value in GAC_unsupported_candidates(constraint, var):
+            if not has_support(var, value):
+                var.prune_value(value)
+                pruned.append((var, value))
+                if var.cur_domain_size() == 0:
+                    return None
+                if not changed or changed[-1] is not var:
+                    changed.append(var)
+    return changed
+
 def GAC_enforce(csp, input_GACQueue):
     """
 
@@ -156,18 +229,14 @@ def GAC_enforce(csp, input_GACQueue):
     pruned = []
     while not GACQueue.empty():
         constraint = GACQueue.get()
-        for var in constraint.get_scope():
-            for value in var.cur_domain():
-                if not constraint.has_support(var, value):
-                    var.prune_value(value)
-                    pruned.append((var, value))
-                    if var.cur_domain_size() == 0:
-                        # DWO = True
-                        return True, pruned
-                    else:
-                        for con in csp.get_cons_with_var(var):
-                            if con != constraint:
-                                GACQueue.put(con)
+        changed = GAC_revise(constraint, pruned)
+        if changed is None:
+            # DWO = True
+            return True, pruned
+        for var in changed:
+            for con in csp.get_cons_with_var(var):
+                if con != constraint:
+                    GACQueue.put(con)
 
     return False, pruned
 
@@ -189,6 +258,397 @@ def prop_GAC(csp, newVar=None):
     else:
         return (True, pruned)
 
+def SAC_enforce(csp):
+    """
+
+    :param csp: the csp on which singleton arc consistency is enforced; it must already be GAC
+    :return: True iff DWO happens; a list of (var, pruned_value) pairs
+    """
+    pruned = []
+    changed = True
+    while changed:
+        changed = False
+        for var in csp.get_all_unasgn_vars():
+            for value in var.cur_domain():
+                #the GAC cascade of an earlier prune may have removed value
+                if not var.in_cur_domain(value):
+                    continue
+                #tentatively assign (var, value) and see whether GAC wipes out a domain
+                var.assign(value)
+                status, tentative_pruned = prop_GAC(csp, var)
+                for tentative_var, tentative_value in tentative_pruned:
+                    tentative_var.unprune_value(tentative_value)
+                var.unassign()
+                if status:
+                    continue
+
+                #(var, value) is singleton inconsistent, so prune it permanently
+                var.prune_value(value)
+                pruned.append((var, value))
+                changed = True
+                if var.cur_domain_size() == 0:
+                    return True, pruned
+                GACQueue = UniqueQueue()
+                for con in csp.get_cons_with_var(var):
+                    GACQueue.put(con)
+                DWO, GAC_pruned = GAC_enforce(csp, GACQueue)
+                pruned.extend(GAC_pruned)
+                if DWO:
+                    return True, pruned
+
+    return False, pruned
+
+def prop_SAC(csp, newVar=None):
+    '''Do singleton arc consistency preprocessing. If newVar is None we
+       establish GAC and then prune every value whose tentative assignment
+       leads to a DWO under GAC. Otherwise we do ordinary GAC propagation,
+       since SAC is only worth its cost once, before search'''
+    status, pruned = prop_GAC(csp, newVar)
+    if not status or newVar:
+        return (status, pruned)
+
+    DWO, SAC_pruned = SAC_enforce(csp)
+    pruned.extend(SAC_pruned)
+    if DWO:
+        return (False, pruned)
+    else:
+        return (True, pruned)
+
+def constraint_group(constraint):
+    """
+
+    :param constraint: a constraint
+    :return: the group of "constraint" for AdaptivePropagator: its class, its arity and the number of digits of the
+             size of its table (0 for constraints that are not table based)
+    """
+    size = len(constraint.sat_tuples) if constraint.table_based else 0
+    return (type(constraint), len(constraint.get_scope()), len(str(size)))
+
+class AdaptivePropagator:
+    '''Propagator choosing, for every kind of constraint, between GAC and
+       forward checking from what GAC measurably buys on it. Use an
+       instance as the propagator of bt_search, e.g.
+           solver.bt_search(AdaptivePropagator(), ord_mrv)
+       (one instance per search, as it learns during the search).
+
+       Constraints are grouped by class, arity and order of magnitude of
+       their table (see constraint_group). For every group, the values a
+       GAC revision prunes (a dead end counting as dwo_gain values) and
+       the milliseconds it takes are kept as moving averages. A group is
+       productive while it prunes at least min_rate values per
+       millisecond of revision: its constraints are revised as by
+       prop_GAC. The others are only forward checked, as by prop_FC, when
+       a single variable of their scope is left unassigned. Every
+       probe_every-th node, each group gets probe_size revisions anyway,
+       so that the estimate of an unproductive group stays current.
+
+       The root is treated the same way, starting with every group
+       productive: a group pruning nothing at the root (the binary tables
+       of n-Queens) stops being revised after a few constraints, instead
+       of paying for a full GAC pass.'''
+
+    def __init__(self, min_rate=2.0, probe_every=64, probe_size=4, dwo_gain=4, decay=0.95):
+        self.min_rate = min_rate
+        self.probe_every = probe_every
+        self.probe_size = probe_size
+        self.dwo_gain = dwo_gain
+        self.decay = decay
+        self.group = dict()         #constraint --> its group
+        self.gain = dict()          #group --> moving average of the values pruned per revision
+        self.cost = dict()          #group --> moving average of the milliseconds per revision
+        self.probes = dict()        #group --> revisions left to probe it at this node
+        self.n_calls = 0
+        self.n_gac = 0              #number of GAC revisions, for statistics
+        self.n_fc = 0               #number of constraints forward checked
+
+    def productive(self, group):
+        '''Internal. True iff the constraints of group are to be revised by GAC'''
+        return self.gain[group] >= self.min_rate * self.cost[group] or self.probes.get(group, 0) > 0
+
+    def forward_check(self, constraint, pruned):
+        '''Internal. Forward check constraint if a single variable of its
+           scope is unassigned, return True iff DWO happens'''
+        if constraint.get_n_unasgn() != 1:
+            return False
+        self.n_fc += 1
+        DWO, _, pruned_values = FC_check(constraint, constraint.get_unasgn_vars()[0])
+        pruned.extend(pruned_values)
+        return DWO
+
+    def __call__(self, csp, newVar=None):
+        if not newVar:
+            constraints = csp.get_all_cons()
+            for constraint in constraints:
+                group = constraint_group(constraint)
+                self.group[constraint] = group
+                if not group in self.gain:
+                    self.gain[group] = 1.0
+                    self.cost[group] = 0.0
+            self.probes = dict()
+        else:
+            constraints = csp.get_cons_with_var(newVar)
+            self.n_calls += 1
+            if self.n_calls % self.probe_every == 0:
+                self.probes = dict((group, self.probe_size) for group in self.gain)
+            else:
+                self.probes = dict()
+
+        productive = set(group for group in self.gain if self.productive(group))
+        pruned = []
+        GACQueue = UniqueQueue()
+        for constraint in constraints:
+            if self.group[constraint] in productive:
+                GACQueue.put(constraint)
+            elif self.forward_check(constraint, pruned):
+                return (False, pruned)
+        if not productive:
+            return (True, pruned)
+        for var, _ in list(pruned):
+            for constraint in csp.get_cons_with_var(var):
+                if self.group[constraint] in productive:
+                    GACQueue.put(constraint)
+
+        while not GACQueue.empty():
+            constraint = GACQueue.get()
+            group = self.group[constraint]
+            if not self.productive(group):
+                #the group turned out unproductive during this call
+                if self.forward_check(constraint, pruned):
+                    return (False, pruned)
+                continue
+            n_pruned = len(pruned)
+            start = time.perf_counter()
+            changed = GAC_revise(constraint, pruned)
+            elapsed = time.perf_counter() - start
+            self.n_gac += 1
+            if group in self.probes:
+                self.probes[group] -= 1
+            gain = self.dwo_gain if changed is None else len(pruned) - n_pruned
+            self.gain[group] = self.decay * self.gain[group] + (1 - self.decay) * gain
+            self.cost[group] = self.decay * self.cost[group] + (1 - self.decay) * elapsed * 1000
+            if changed is None:
+                return (False, pruned)
+            for var in changed:
+                for con in csp.get_cons_with_var(var):
+                    if con is not constraint and self.group[con] in productive:
+                        GACQueue.put(con)
+        return (True, pruned)
+
+class AC4Propagator:
+    '''GAC propagator keeping, in the manner of AC-4, the number of
+       supports of every value in every constraint, so that a pruned value
+       costs one decrement per tuple it takes away instead of new support
+       scans. Use an instance as the propagator of bt_search, e.g.
+           solver.bt_search(AC4Propagator(), ord_mrv)
+       (one instance per CSP; the root call builds the counters).
+
+       Every constraint is turned into its list of tuples: the table of
+       a table based constraint, otherwise the tuples of the product of
+       the current domains of its scope that satisfy check. A tuple is
+       alive while all its values are current; supports[(var, val)] lists
+       the tuples holding var=val, and counts holds, for every constraint
+       and position, the number of alive tuples per value. Assigning var
+       takes away its other values. When the count of a value drops to 0
+       the value is pruned (a dead end if its variable is assigned to it),
+       and its tuples die in turn. Constraints with more than max_tuples
+       tuples are revised with has_support instead, as by prop_GAC.
+
+       A NotEqualConstraint gets no tuples: the number of supports of
+       var=val is the number of current values of the other variable
+       but val, which the other variable already counts (curdom_count).
+       It drops to 0 only when the other variable is down to val, so when
+       a variable is left with a single value, that value is pruned from
+       its not-equal neighbours.
+
+       BT restores the pruned values on backtracking without telling the
+       propagator, so every call first brings back to life the tuples
+       killed by the earlier calls that BT has undone since: those made
+       for a variable that is no longer assigned, or for the variable
+       assigned now (an earlier value of it). The calls are kept as a
+       stack of (variable, tuples killed), so this costs nothing per
+       call beyond the calls undone.'''
+
+    def __init__(self, max_tuples=10**5):
+        self.max_tuples = max_tuples
+        self.tuples = dict()        #constraint --> list of its tuples alive at the root
+        self.alive = dict()         #constraint --> bytearray, 1 for the tuples alive
+        self.counts = dict()        #constraint --> list, per position, of dict value --> alive tuples
+        self.supports = dict()      #(var, val) --> list of (constraint, tuple number)
+        self.not_equal = dict()     #var --> the other variables of the NotEqualConstraints over var
+        self.fallback = set()       #constraints revised with has_support
+        self.trail = []             #(var assigned, [(constraint, tuple number) killed]) per call, deepest last
+        self.n_killed = 0           #number of tuples killed, for statistics
+
+    def constraint_tuples(self, constraint):
+        '''Internal. The tuples of constraint, None if there are more
+           than max_tuples'''
+        scope = constraint.get_scope()
+        if constraint.table_based:
+            if len(constraint.sat_tuples) > self.max_tuples:
+                return None
+            return list(constraint.sat_tuples)
+        size = 1
+        for var in scope:
+            size *= var.cur_domain_size()
+        if size > self.max_tuples:
+            return None
+        return [t for t in itertools.product(*[var.cur_domain() for var in scope]) if constraint.check(t)]
+
+    def build(self, csp):
+        '''Internal. Set up the tuples, counters and support lists of
+           the constraints of csp from the current domains'''
+        self.tuples = dict()
+        self.alive = dict()
+        self.counts = dict()
+        self.supports = dict()
+        self.not_equal = dict()
+        self.fallback = set()
+        self.trail = []
+        for constraint in csp.get_all_cons():
+            if isinstance(constraint, NotEqualConstraint):
+                #the supports of var=val are counted already: they are the
+                #current values of the other variable but val
+                for var in constraint.get_scope():
+                    if not var in self.not_equal:
+                        self.not_equal[var] = []
+                    self.not_equal[var].append(constraint.other_var(var))
+                continue
+            tuples = self.constraint_tuples(constraint)
+            if tuples is None:
+                self.fallback.add(constraint)
+                continue
+            scope = constraint.get_scope()
+            tuples = [t for t in tuples if constraint.tuple_is_valid(t)]
+            counts = [dict.fromkeys(var.domain(), 0) for var in scope]
+            for n, t in enumerate(tuples):
+                for j, val in enumerate(t):
+                    counts[j][val] += 1
+                    key = (scope[j], val)
+                    if not key in self.supports:
+                        self.supports[key] = []
+                    self.supports[key].append((constraint, n))
+            self.tuples[constraint] = tuples
+            self.alive[constraint] = bytearray([1]) * len(tuples)
+            self.counts[constraint] = counts
+
+    def revive(self, killed):
+        '''Internal. Bring the tuples of killed back to life'''
+        for constraint, n in killed:
+            self.alive[constraint][n] = 1
+            counts = self.counts[constraint]
+            for j, val in enumerate(self.tuples[constraint][n]):
+                counts[j][val] += 1
+
+    def fix_not_equal(self, var, removed, pruned):
+        '''Internal. var is down to a single value: take it away from the
+           not-equal neighbours of var. Returns False on a dead end'''
+        val = var.cur_domain()[0]
+        for other in self.not_equal.get(var, ()):
+            if not other.in_cur_domain(val):
+                continue
+            if other.is_assigned():
+                return False
+            other.prune_value(val)
+            pruned.append((other, val))
+            if other.cur_domain_size() == 0:
+                return False
+            removed.append((other, val))
+        return True
+
+    def propagate(self, csp, removed, queue, killed, pruned):
+        '''Internal. Kill the tuples of the removed (var, val) pairs,
+           prune the values left without support and revise the fallback
+           constraints of queue, until nothing changes. Returns False on a
+           dead end'''
+        while removed or not queue.empty():
+            while removed:
+                var, val = removed.pop()
+                if not var.is_assigned() and var.cur_domain_size() == 1 and var in self.not_equal:
+                    if not self.fix_not_equal(var, removed, pruned):
+                        return False
+                for constraint, n in self.supports.get((var, val), ()):
+                    alive = self.alive[constraint]
+                    if not alive[n]:
+                        continue
+                    alive[n] = 0
+                    killed.append((constraint, n))
+                    counts = self.counts[constraint]
+                    unsupported = []
+                    for j, other_val in enumerate(self.tuples[constraint][n]):
+                        counts[j][other_val] -= 1
+                        if counts[j][other_val] == 0:
+                            unsupported.append((constraint.scope[j], other_val))
+                    #pruned only once the whole tuple is counted out, as
+                    #revive counts it back in at every position
+                    for other, other_val in unsupported:
+                        if not other.in_cur_domain(other_val):
+                            continue
+                        if other.is_assigned():
+                            return False
+                        other.prune_value(other_val)
+                        pruned.append((other, other_val))
+                        if other.cur_domain_size() == 0:
+                            return False
+                        removed.append((other, other_val))
+                        for con in csp.get_cons_with_var(other):
+                            if con in self.fallback:
+                                queue.put(con)
+            if not queue.empty():
+                constraint = queue.get()
+                first = len(pruned)
+                changed = GAC_revise(constraint, pruned)
+                if changed is None:
+                    return False
+                removed.extend(pruned[first:])
+                for var in changed:
+                    for con in csp.get_cons_with_var(var):
+                        if con in self.fallback and con != constraint:
+                            queue.put(con)
+        return True
+
+    def __call__(self, csp, newVar=None):
+        pruned = []
+        queue = UniqueQueue()
+        if not newVar:
+            self.build(csp)
+            removed = []
+            for constraint, counts in self.counts.items():
+                for var, var_counts in zip(constraint.get_scope(), counts):
+                    for val in var.cur_domain():
+                        if var_counts[val] == 0 and var.in_cur_domain(val):
+                            var.prune_value(val)
+                            pruned.append((var, val))
+                            removed.append((var, val))
+                            if var.cur_domain_size() == 0:
+                                return (False, pruned)
+            for var in self.not_equal:
+                if var.cur_domain_size() == 1 and not self.fix_not_equal(var, removed, pruned):
+                    return (False, pruned)
+            for constraint in self.fallback:
+                queue.put(constraint)
+            #the root prunings are never undone during the search, nothing to trail
+            status = self.propagate(csp, removed, queue, [], pruned)
+            return (status, pruned)
+
+        while self.trail and (self.trail[-1][0] is newVar or not self.trail[-1][0].is_assigned()):
+            self.revive(self.trail.pop()[1])
+        killed = []
+        self.trail.append((newVar, killed))
+
+        #assigning newVar takes its other current values away
+        value = newVar.get_assigned_value()
+        newVar.unassign()
+        removed = [(newVar, val) for val in newVar.cur_domain() if val != value]
+        newVar.assign(value)
+        if not self.fix_not_equal(newVar, removed, pruned):
+            return (False, pruned)
+        for con in csp.get_cons_with_var(newVar):
+            if con in self.fallback:
+                queue.put(con)
+        status = self.propagate(csp, removed, queue, killed, pruned)
+        self.n_killed += len(killed)
+        return (status, pruned)
+
 if __name__ == '__main__':
     #test UniqueQueue
     q = UniqueQueue()
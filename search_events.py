@@ -0,0 +1,185 @@
+'''
+This file contains the search event log of BT (see cspbase.py), a
+structured, low-overhead replacement of printing a trace.
+
+BT reports its search to an event sink, an object with the method
+
+    emit(kind, level, var=None, val=None, status=None, prunings=None)
+
+and a close() method. kind is one of
+
+    'start'      search begins; prunings is None, val the number of
+                 unassigned variables
+    'root'       root propagation done; status and prunings are its result
+    'decision'   var is assigned val at depth level
+    'propagate'  propagation after the decision var=val returned status
+    'prune'      prunings are the (var, val) pairs pruned by that propagation
+    'backtrack'  all values of var at depth level failed
+    'solution'   all variables are assigned
+    'end'        search is over; status is its outcome, None if the
+                 search was cancelled (see BT.bt_search_async)
+
+When BT has no sink (the default) no event is built at all, so logging
+costs nothing when disabled.
+
+Sinks offered here:
+    PrintEventSink    prints the events, used by BT.trace_on
+    JSONLinesSink     one JSON object per event, buffered
+    BinaryEventSink   compact fixed size binary records, buffered;
+                      read back with read_binary_events
+'''
+import io
+import json
+import struct
+
+#one letter codes of the event kinds, used by the JSONL and binary sinks
+EVENT_CODES = {'start': 's', 'root': 'r', 'decision': 'd', 'propagate': 'p', 'prune': 'x',
+               'backtrack': 'b', 'solution': 'S', 'end': 'e'}
+EVENT_KINDS = dict((code, kind) for kind, code in EVENT_CODES.items())
+
+class PrintEventSink:
+    '''Print every event, indented by search depth'''
+
+    def emit(self, kind, level, var=None, val=None, status=None, prunings=None):
+        if kind == 'start':
+            print(val, " unassigned variables at start of search")
+        elif kind == 'root':
+            print("Root Prunings: ", prunings)
+        elif kind == 'decision':
+            print('  ' * level, "bt_recurse trying", var, "=", val)
+        elif kind == 'propagate':
+            print('  ' * level, "bt_recurse prop status = ", status)
+        elif kind == 'prune':
+            print('  ' * level, "bt_recurse prop pruned = ", prunings)
+        elif kind == 'backtrack':
+            print('  ' * level, "bt_recurse backtracking over", var)
+        elif kind == 'solution':
+            print('  ' * level, "bt_recurse all variables assigned")
+        elif kind == 'end':
+            print("search finished, status = ", status)
+
+    def close(self):
+        pass
+
+class JSONLinesSink:
+    '''Write every event as a JSON object on its own line, e.g.
+           {"e":"d","l":3,"var":"Var_12","val":4}
+       Variables are written by name, prunings as [name, value] pairs.
+       Records are buffered and written buffer_size at a time, and at the
+       end of every search.'''
+
+    def __init__(self, out, buffer_size=1024):
+        '''out == a path or an open text file'''
+        self.own_file = isinstance(out, str)
+        self.file = open(out, 'w') if self.own_file else out
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def emit(self, kind, level, var=None, val=None, status=None, prunings=None):
+        record = {'e': EVENT_CODES[kind], 'l': level}
+        if var is not None:
+            record['var'] = var.name
+        if val is not None:
+            record['val'] = val
+        if status is not None:
+            record['ok'] = bool(status)
+        if prunings is not None:
+            record['pruned'] = [[v.name, pruned_val] for v, pruned_val in prunings]
+        self.buffer.append(json.dumps(record, separators=(',', ':'), default=str))
+        if len(self.buffer) >= self.buffer_size or kind == 'end':
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write('\n'.join(self.buffer) + '\n')
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.own_file:
+            self.file.close()
+
+#binary record: event code, level, variable id, value, status, number of prunings
+#followed by that many (variable id, value) pairs
+RECORD = struct.Struct('<cHiibI')
+PAIR = struct.Struct('<ii')
+MAGIC = b'BTEV1\n'
+
+class BinaryEventSink:
+    '''Write every event as a packed binary record (RECORD, then PAIR for
+       each pruning). Variables are written by their position in csp.vars;
+       the 'start' event writes the position --> name table first.
+       Domain values must be integers. Records are buffered in memory and
+       written buffer_size bytes at a time, and at the end of every search.'''
+
+    def __init__(self, out, csp, buffer_size=1 << 16):
+        '''out == a path or an open binary file. csp == the CSP searched'''
+        self.own_file = isinstance(out, str)
+        self.file = open(out, 'wb') if self.own_file else out
+        self.csp = csp
+        self.var_ids = dict()       #var --> its position in csp.vars, set by the 'start' event
+        self.buffer_size = buffer_size
+        self.buffer = io.BytesIO()
+
+    def emit(self, kind, level, var=None, val=None, status=None, prunings=None):
+        if kind == 'start':
+            self.var_ids = dict((v, i) for i, v in enumerate(self.csp.vars))
+            names = json.dumps([v.name for v in self.csp.vars]).encode('utf-8')
+            self.buffer.write(MAGIC + struct.pack('<I', len(names)) + names)
+        self.buffer.write(RECORD.pack(EVENT_CODES[kind].encode('ascii'), level,
+                                      -1 if var is None else self.var_ids[var],
+                                      0 if val is None else val,
+                                      -1 if status is None else int(bool(status)),
+                                      0 if prunings is None else len(prunings)))
+        if prunings is not None:
+            for v, pruned_val in prunings:
+                self.buffer.write(PAIR.pack(self.var_ids[v], pruned_val))
+        if self.buffer.tell() >= self.buffer_size or kind == 'end':
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer.getvalue())
+        self.buffer = io.BytesIO()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.own_file:
+            self.file.close()
+
+def read_binary_events(path):
+    """
+
+    :param path: a file written by BinaryEventSink
+    :return: a list of dicts, one per event, with keys kind, level, var (a variable name or None), val, status
+             (True/False or None) and prunings (a list of (variable name, value) pairs or None)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    events = []
+    names = []
+    pos = 0
+    while pos < len(data):
+        if data[pos:pos+len(MAGIC)] == MAGIC:
+            pos += len(MAGIC)
+            (length,) = struct.unpack_from('<I', data, pos)
+            pos += 4
+            names = json.loads(data[pos:pos+length].decode('utf-8'))
+            pos += length
+        code, level, var_id, val, status, n = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        kind = EVENT_KINDS[code.decode('ascii')]
+        prunings = None
+        if kind in ('root', 'prune'):
+            prunings = []
+            for _ in range(n):
+                pruned_id, pruned_val = PAIR.unpack_from(data, pos)
+                pos += PAIR.size
+                prunings.append((names[pruned_id], pruned_val))
+        events.append({'kind': kind, 'level': level,
+                       'var': None if var_id < 0 else names[var_id],
+                       'val': val if kind in ('start', 'decision', 'propagate') else None,
+                       'status': None if status < 0 else bool(status),
+                       'prunings': prunings})
+    return events
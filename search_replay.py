@@ -0,0 +1,211 @@
+'''
+This file contains the recording of the search path of bt_search and its
+deterministic replay, to find where a change of the solver makes a board
+slow.
+
+A SearchRecorder is an event sink (see search_events.py) keeping, for
+every node of the search, the decision (level, variable, value), the
+outcome of its propagation (status and number of prunings) and the time
+it took:
+
+    recorder = SearchRecorder()
+    solver.log_events(recorder)
+    solver.bt_search(prop_GAC, ord_mrv)
+    recorder.save('board7.path')
+
+replay then follows the recorded decisions, and only them, on a freshly
+built CSP with any propagator, which may come from another version of the
+solver. No heuristic is called, so the path is the same whatever the
+orderings do. Every node is timed and its outcome compared with the
+recording:
+
+    report = replay(csp, prop_GAC, load_recording('board7.path'))
+    report.print_summary()
+
+A node diverges when its propagation status or number of prunings differ
+from the recording. When the replayed propagator fails where the recorded
+one did not, or a recorded value is no longer in the current domain, the
+recorded subtree below that node cannot be followed and is skipped.
+
+Variables are matched by name, so names must be unique; values must be
+JSON serializable (KenKen values are integers).
+'''
+import json
+import time
+
+from cspbase import BT
+
+class SearchRecorder:
+    '''Event sink recording the search path of the last search'''
+
+    def __init__(self, csp_name=None):
+        self.csp_name = csp_name
+        self.root = None        #[status, number of prunings] of the root propagation
+        self.status = None      #outcome of the search
+        self.nodes = []         #[level, variable name, value, status, number of prunings, seconds] per decision
+        self.node_start = 0
+
+    def emit(self, kind, level, var=None, val=None, status=None, prunings=None):
+        if kind == 'decision':
+            self.nodes.append([level, var.name, val, None, 0, 0.0])
+            self.node_start = time.perf_counter()
+        elif kind == 'propagate':
+            node = self.nodes[-1]
+            node[3] = bool(status)
+            node[5] = time.perf_counter() - self.node_start
+        elif kind == 'prune':
+            self.nodes[-1][4] = len(prunings)
+        elif kind == 'root':
+            self.root = [bool(status), len(prunings)]
+        elif kind == 'start':
+            self.root = None
+            self.status = None
+            self.nodes = []
+        elif kind == 'end':
+            self.status = bool(status)
+
+    def close(self):
+        pass
+
+    def save(self, out):
+        """
+
+        :param out: a path or an open text file
+        :return: None; the recording is written as JSON lines, a header then one line per node
+        """
+        own_file = isinstance(out, str)
+        f = open(out, 'w') if own_file else out
+        try:
+            f.write(json.dumps({'csp': self.csp_name, 'root': self.root, 'status': self.status,
+                                'nodes': len(self.nodes)}) + '\n')
+            for node in self.nodes:
+                f.write(json.dumps(node, separators=(',', ':')) + '\n')
+        finally:
+            if own_file:
+                f.close()
+
+def load_recording(source):
+    """
+
+    :param source: a path or an open text file written by SearchRecorder.save
+    :return: a SearchRecorder holding the recording
+    """
+    own_file = isinstance(source, str)
+    f = open(source) if own_file else source
+    try:
+        recorder = SearchRecorder()
+        header = json.loads(f.readline())
+        recorder.csp_name = header['csp']
+        recorder.root = header['root']
+        recorder.status = header['status']
+        for line in f:
+            if line.strip():
+                recorder.nodes.append(json.loads(line))
+    finally:
+        if own_file:
+            f.close()
+    return recorder
+
+class ReplayReport:
+    '''Outcome of a replay. nodes holds, per recorded node followed,
+       [index in the recording, level, variable name, value, status,
+       number of prunings, seconds]; divergences the indices (in nodes)
+       of the nodes whose status or number of prunings differ from the
+       recording; skipped the number of recorded nodes not followed.'''
+
+    def __init__(self, recording):
+        self.recording = recording
+        self.root = None
+        self.nodes = []
+        self.divergences = []
+        self.skipped = 0
+        self.runtime = 0
+
+    def first_divergence(self):
+        '''return the first diverging node as a pair (recorded node,
+           replayed node), None if the replay followed the recording'''
+        if not self.divergences:
+            return None
+        node = self.nodes[self.divergences[0]]
+        return (self.recording.nodes[node[0]], node)
+
+    def slowest(self, n=10):
+        '''return the n replayed nodes whose time grew the most, as
+           (recorded node, replayed node) pairs'''
+        pairs = [(self.recording.nodes[node[0]], node) for node in self.nodes]
+        pairs.sort(key=lambda pair: pair[1][6] - pair[0][5], reverse=True)
+        return pairs[:n]
+
+    def print_summary(self):
+        recorded_time = sum(node[5] for node in self.recording.nodes)
+        print("Replayed {} of {} recorded nodes in {:.3f}s (recorded {:.3f}s)".format(
+            len(self.nodes), len(self.recording.nodes), self.runtime, recorded_time))
+        print("Prunings: replayed {}, recorded {}".format(
+            sum(node[5] for node in self.nodes),
+            sum(self.recording.nodes[node[0]][4] for node in self.nodes)))
+        if self.root != self.recording.root:
+            print("Root propagation differs: replayed {}, recorded {}".format(self.root, self.recording.root))
+        if self.divergences:
+            recorded, replayed = self.first_divergence()
+            print("{} nodes diverge; the first is {}={} at level {}: status {} with {} prunings, recorded {} with {}".format(
+                len(self.divergences), replayed[2], replayed[3], replayed[1], replayed[4], replayed[5],
+                recorded[3], recorded[4]))
+        else:
+            print("Every node matches the recording")
+        if self.skipped:
+            print("{} recorded nodes could not be followed".format(self.skipped))
+
+def replay(csp, propagator, recording, sink=None):
+    """
+
+    :param csp: the CSP the recording was made on, freshly built (variables unassigned)
+    :param propagator: the propagator to replay the path with
+    :param recording: a SearchRecorder, e.g. from load_recording
+    :param sink: an optional event sink (see search_events.py) the replayed nodes are reported to
+    :return: a ReplayReport; every variable of csp is unassigned and its domain restored on return
+    """
+    report = ReplayReport(recording)
+    by_name = dict((var.name, var) for var in csp.get_all_vars())
+    bt = BT(csp)
+    bt.log_events(sink)
+
+    stime = time.process_time()
+    status, root_prunings = bt.start_search(propagator)
+    report.root = [bool(status), len(root_prunings)]
+    trail = []          #(var, prunings) of the decisions on the current path
+    skip_below = None   #level of a node whose subtree cannot be followed
+    if status:
+        for index, (level, name, val, recorded_status, recorded_n, _) in enumerate(recording.nodes):
+            if skip_below is not None:
+                if level > skip_below:
+                    report.skipped += 1
+                    continue
+                skip_below = None
+            while len(trail) >= level:
+                var, prunings = trail.pop()
+                bt.undo_value(var, prunings)
+            var = by_name.get(name)
+            if var is None or var.is_assigned() or not var.in_cur_domain(val) or len(trail) != level - 1:
+                report.skipped += 1
+                skip_below = level
+                continue
+
+            node_start = time.perf_counter()
+            status, prunings = bt.try_value(propagator, var, val, level)
+            elapsed = time.perf_counter() - node_start
+            trail.append((var, prunings))
+            if bool(status) != recorded_status or len(prunings) != recorded_n:
+                report.divergences.append(len(report.nodes))
+            report.nodes.append([index, level, name, val, bool(status), len(prunings), elapsed])
+            if not status and recorded_status:
+                skip_below = level
+
+        while trail:
+            var, prunings = trail.pop()
+            bt.undo_value(var, prunings)
+    bt.restoreValues(root_prunings)
+    bt.release_propagator(propagator)
+    report.runtime = time.process_time() - stime
+    if sink:
+        sink.emit('end', 0, status=recording.status)
+    return report
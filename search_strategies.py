@@ -0,0 +1,164 @@
+'''
+This file contains tree search strategies for BT, alternatives to the
+chronological depth-first search of bt_recurse. Install one with
+BT.set_strategy, then search with bt_search as usual:
+
+    solver = BT(csp)
+    solver.set_strategy(lds)
+    solver.bt_search(prop_GAC, ord_mrv, val_lcv)
+
+A strategy is a function with the template
+
+    strategy(bt, propagator, var_ord, val_ord)
+        ==> returns True/False
+
+that searches the tree below the root of bt (root propagation is done by
+bt_search) with the steps BT offers (select_var, ordered_values,
+try_value, undo_value, release_var), leaving the solution it finds
+assigned, as bt_recurse does. Options are bound with functools.partial,
+e.g. set_strategy(functools.partial(lds, max_discrepancies=3)).
+
+The strategies here trust the value ordering: taking the first value of
+val_ord at a node follows the heuristic, any other value is a
+discrepancy. When the heuristic is good but sometimes wrong high in the
+tree, they reach a solution after exploring far fewer nodes than
+depth-first search, which must exhaust the whole subtree below a wrong
+early choice before revising it.
+
+    lds                    limited discrepancy search: iteration k visits
+                           the paths with exactly k discrepancies
+    dds                    depth-bounded discrepancy search: iteration i
+                           visits the paths whose deepest discrepancy is
+                           at depth i (discrepancies are tried early first)
+    iterative_broadening   iteration b tries the first b values at every
+                           node
+
+All three are complete unless a limit is given: once the iterations are
+exhausted without a solution the CSP has none.
+'''
+
+def lds(bt, propagator, var_ord, val_ord, max_discrepancies=None):
+    """
+
+    :param bt: the BT object searching
+    :param max_discrepancies: the last iteration, None to go on until the search is complete
+    :return: True iff a solution was found (it is left assigned)
+    """
+    n = len(bt.unasgn_vars)
+    limit = n if max_discrepancies is None else min(n, max_discrepancies)
+    for k in range(limit + 1):
+        cut = [False]
+        if lds_probe(bt, propagator, var_ord, val_ord, 1, k, cut):
+            return True
+        if not cut[0]:
+            #no path needed more than k discrepancies: the whole tree was seen
+            break
+    return False
+
+def lds_probe(bt, propagator, var_ord, val_ord, level, k, cut):
+    '''Internal routine. Visit the paths below the current node with
+       exactly k discrepancies (Korf's improved LDS, so that no path is
+       visited twice). cut[0] is set if some value was skipped because
+       it would exceed k discrepancies.'''
+    if not bt.unasgn_vars:
+        if bt.events:
+            bt.events.emit('solution', level)
+        return True
+    depth_left = len(bt.unasgn_vars)
+    var = bt.select_var(var_ord)
+    for i, val in enumerate(bt.ordered_values(var, val_ord)):
+        rest = k if i == 0 else k - 1
+        if rest < 0:
+            cut[0] = True
+            break
+        if rest > depth_left - 1:
+            #the discrepancies left cannot all be spent below this value
+            continue
+        status, prunings = bt.try_value(propagator, var, val, level)
+        if status and lds_probe(bt, propagator, var_ord, val_ord, level+1, rest, cut):
+            return True
+        bt.undo_value(var, prunings)
+    bt.release_var(var, level)
+    return False
+
+def dds(bt, propagator, var_ord, val_ord, max_depth=None):
+    """
+
+    :param bt: the BT object searching
+    :param max_depth: the last iteration (deepest level at which a discrepancy is made), None to go on until the
+                      search is complete
+    :return: True iff a solution was found (it is left assigned)
+    """
+    n = len(bt.unasgn_vars)
+    limit = n if max_depth is None else min(n, max_depth)
+    deepest = [0]
+    for depth in range(limit + 1):
+        if dds_probe(bt, propagator, var_ord, val_ord, 1, depth, deepest):
+            return True
+        if depth >= deepest[0]:
+            #no node with a choice was met below this depth: the whole tree was seen
+            break
+    return False
+
+def dds_probe(bt, propagator, var_ord, val_ord, level, depth, deepest):
+    '''Internal routine. Visit the paths below the current node whose
+       deepest discrepancy is at level depth: every value above it, only
+       discrepancies at it, only the heuristic value below it. deepest[0]
+       is raised to the deepest level of a node with more than one value.'''
+    if not bt.unasgn_vars:
+        if bt.events:
+            bt.events.emit('solution', level)
+        return True
+    var = bt.select_var(var_ord)
+    values = bt.ordered_values(var, val_ord)
+    if len(values) > 1 and level > deepest[0]:
+        deepest[0] = level
+    if level == depth:
+        values = values[1:]
+    elif level > depth:
+        values = values[:1]
+    for val in values:
+        status, prunings = bt.try_value(propagator, var, val, level)
+        if status and dds_probe(bt, propagator, var_ord, val_ord, level+1, depth, deepest):
+            return True
+        bt.undo_value(var, prunings)
+    bt.release_var(var, level)
+    return False
+
+def iterative_broadening(bt, propagator, var_ord, val_ord, max_breadth=None):
+    """
+
+    :param bt: the BT object searching
+    :param max_breadth: the last iteration (number of values tried per node), None to go on until the search is
+                        complete
+    :return: True iff a solution was found (it is left assigned)
+    """
+    breadth = 1
+    while max_breadth is None or breadth <= max_breadth:
+        cut = [False]
+        if broadening_probe(bt, propagator, var_ord, val_ord, 1, breadth, cut):
+            return True
+        if not cut[0]:
+            break
+        breadth += 1
+    return False
+
+def broadening_probe(bt, propagator, var_ord, val_ord, level, breadth, cut):
+    '''Internal routine. Depth-first search trying only the first breadth
+       values at every node. cut[0] is set if some value was skipped.'''
+    if not bt.unasgn_vars:
+        if bt.events:
+            bt.events.emit('solution', level)
+        return True
+    var = bt.select_var(var_ord)
+    values = bt.ordered_values(var, val_ord)
+    if len(values) > breadth:
+        cut[0] = True
+        values = values[:breadth]
+    for val in values:
+        status, prunings = bt.try_value(propagator, var, val, level)
+        if status and broadening_probe(bt, propagator, var_ord, val_ord, level+1, breadth, cut):
+            return True
+        bt.undo_value(var, prunings)
+    bt.release_var(var, level)
+    return False
@@ -0,0 +1,215 @@
+'''
+This file contains a store of constraint tables in a memory-mapped file,
+so that the worker processes of a pool (see solve_components in
+decomposition.py, or any concurrent.futures pool) read the tables of a
+CSP in place instead of each unpickling its own copy of sat_tuples and
+building its own sup_tuples.
+
+    store = TableStore()
+    store.share(csp)        #table constraints become SharedTableConstraint
+    ... send csp to workers, solve ...
+    store.close()           #once the workers are done
+
+A SharedTableConstraint pickles to its name, scope and the location of its
+table in the file; a process maps the file (once per process, whatever the
+number of constraints) the first time one of its constraints is used. The
+pages of the file are then shared by all processes through the page cache,
+so the memory used by the tables stays the same whatever the number of
+workers. Constraints with identical tables (the rows and columns of
+nary_ad_grid) share one copy in the file.
+
+The table of a constraint of arity k with n tuples is stored as int32
+value indices, positions in the domain each scope variable had when the
+table was stored. The constraint keeps that snapshot of the domains, so
+the indices keep their meaning when the domains are later committed
+(CSP.reduce) or reset:
+    tuples     n*k indices, the tuples sorted, for check (binary search)
+    for each position i of the scope
+      starts   domain_size+1 offsets into ids
+      ids      n tuple numbers, grouped by their value at position i:
+               the supports of value j of position i are
+               ids[starts[j]:starts[j+1]], as in sup_tuples
+'''
+import os
+import mmap
+import array
+import tempfile
+
+from cspbase import *
+
+#path --> (mmap, int32 memoryview) of the files mapped by this process
+mapped_files = dict()
+
+def map_table_file(path, min_size):
+    '''Internal. Return the int32 view of the file at path, mapped once
+       per process (again if it grew past the mapped size)'''
+    if path in mapped_files and len(mapped_files[path][0]) >= min_size:
+        return mapped_files[path][1]
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm).cast('i')
+    mapped_files[path] = (mm, view)
+    return view
+
+def value_indices(values):
+    '''Internal. Return the dict value --> index of its first occurrence
+       in values'''
+    indices = dict()
+    for j, val in enumerate(values):
+        if not val in indices:
+            indices[val] = j
+    return indices
+
+class TableStore:
+    '''Append-only file of constraint tables. Tables are written by the
+       process that builds the CSP; every process may read them.'''
+
+    def __init__(self, path=None):
+        '''path is the file to write; by default a temporary file, removed
+           by close'''
+        self.own_file = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='cspbase_tables_', suffix='.bin')
+            os.close(fd)
+        self.path = path
+        self.file = open(path, 'wb')
+        self.size = 0               #in int32 items
+        self.tables = dict()        #encoded table --> its layout, to share identical tables
+
+    def add(self, constraint):
+        '''Write the table of constraint (a table based Constraint) to the
+           store, return a SharedTableConstraint over the same scope
+           reading it'''
+        scope = constraint.get_scope()
+        arity = len(scope)
+        values = [tuple(var.dom) for var in scope]
+        indices = [value_indices(vals) for vals in values]
+        rows = sorted(tuple(indices[i][val] for i, val in enumerate(t))
+                      for t in constraint.sat_tuples)
+        tuples = array.array('i')
+        for row in rows:
+            tuples.extend(row)
+        key = (tuple(len(vals) for vals in values), tuples.tobytes())
+
+        if not key in self.tables:
+            data = array.array('i', tuples)
+            layout = [self.size, len(rows), []]
+            for i in range(arity):
+                buckets = [[] for _ in range(len(values[i]))]
+                for n, row in enumerate(rows):
+                    buckets[row[i]].append(n)
+                starts_offset = self.size + len(data)
+                start = 0
+                data.append(0)
+                for bucket in buckets:
+                    start += len(bucket)
+                    data.append(start)
+                for bucket in buckets:
+                    data.extend(bucket)
+                layout[2].append(starts_offset)
+            self.file.write(data.tobytes())
+            self.file.flush()
+            self.size += len(data)
+            self.tables[key] = layout
+
+        offset, n_tuples, starts_offsets = self.tables[key]
+        return SharedTableConstraint(constraint.name, scope, values, self.path, offset, n_tuples,
+                                     starts_offsets, self.size * 4)
+
+    def share(self, csp):
+        '''Replace every table based Constraint of csp by a
+           SharedTableConstraint reading its table from the store.
+           Returns the number of constraints replaced'''
+        n = 0
+        for c in list(csp.get_all_cons()):
+            if type(c) is Constraint:
+                csp.replace_constraint(c, self.add(c))
+                n += 1
+        return n
+
+    def close(self):
+        '''Stop writing, and remove the file if it is a temporary one.
+           Processes that have mapped it can still read it, but no other
+           process can map it any more.'''
+        if not self.file.closed:
+            self.file.close()
+        if self.own_file and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SharedTableConstraint(Constraint):
+    '''Table constraint whose table is kept in a TableStore file rather
+       than in sat_tuples. It is read only: reduce_to_cur_domains leaves
+       it alone. Its value indices refer to values, the domains of the
+       scope when the table was stored, not to the current var.dom.'''
+
+    table_based = False
+
+    def __init__(self, name, scope, values, path, offset, n_tuples, starts_offsets, min_size):
+        Constraint.__init__(self, name, scope)
+        self.values = values                    #per position, the domain the indices refer to
+        self.indices = [value_indices(vals) for vals in values]
+        self.path = path
+        self.offset = offset                    #of the tuples, in int32 items
+        self.n_tuples = n_tuples
+        self.starts_offsets = starts_offsets    #of the starts of each position
+        self.min_size = min_size                #in bytes, the file holds the table once this long
+        self.position = dict((var, i) for i, var in enumerate(self.scope))
+        self.view = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['view'] = None
+        return state
+
+    def table(self):
+        '''Internal. The int32 view of the store file'''
+        if self.view is None:
+            self.view = map_table_file(self.path, self.min_size)
+        return self.view
+
+    def check(self, vals):
+        scope = self.scope
+        arity = len(scope)
+        row = []
+        for indices, val in zip(self.indices, vals):
+            if not val in indices:
+                return False
+            row.append(indices[val])
+        view = self.table()
+        lo, hi = 0, self.n_tuples
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.offset + mid * arity
+            if view[start:start+arity].tolist() < row:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = self.offset + lo * arity
+        return lo < self.n_tuples and view[start:start+arity].tolist() == row
+
+    def has_support(self, var, val):
+        if not var in self.position or not var.in_cur_domain(val):
+            return False
+        i = self.position[var]
+        if not val in self.indices[i]:
+            return False
+        j = self.indices[i][val]
+        view = self.table()
+        scope = self.scope
+        arity = len(scope)
+        starts = self.starts_offsets[i]
+        ids_offset = starts + len(self.values[i]) + 1
+        for n in view[ids_offset + view[starts+j]:ids_offset + view[starts+j+1]]:
+            start = self.offset + n * arity
+            for k, index in enumerate(view[start:start+arity]):
+                if not scope[k].in_cur_domain(self.values[k][index]):
+                    break
+            else:
+                return True
+        return False